@@ -0,0 +1,468 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Compares two evaluation runs with paired significance tests.
+
+The per-program metrics that each run stores in `predictions.jsonl` are
+aligned by task and program name. For every task, and for every tag over the
+programs of all tasks with that tag, the mean difference between the runs is
+reported with a paired bootstrap confidence interval and the p-value of a
+paired sign-flip permutation test. Both tests are vectorized over the
+resamples and the metrics, in blocks of bounded size, so tens of thousands of
+programs are compared in seconds.
+"""
+
+import dataclasses
+import io
+import json
+from typing import Any, Sequence
+
+from absl import app
+from absl import flags
+from etils import epath
+import numpy as np
+
+from codesembench.api import task_lib
+from codesembench.api import task_loader
+
+# The report is written to `<output directory>/comparison.{md,json}`.
+REPORT_BASENAME = 'comparison'
+DEFAULT_NUM_RESAMPLES = 1000
+DEFAULT_CONFIDENCE = 0.95
+
+# Upper bound on the number of program draws held in memory at a time.
+_MAX_BLOCK_SIZE = 2**22
+
+_BASELINE_DIRECTORY = flags.DEFINE_string(
+    'baseline_directory',
+    None,
+    'Output directory of the baseline run.',
+    required=True,
+)
+_CANDIDATE_DIRECTORY = flags.DEFINE_string(
+    'candidate_directory',
+    None,
+    'Output directory of the candidate run.',
+    required=True,
+)
+_NUM_RESAMPLES = flags.DEFINE_integer(
+    'num_resamples',
+    DEFAULT_NUM_RESAMPLES,
+    'Number of bootstrap and permutation resamples.',
+)
+_SEED = flags.DEFINE_integer('seed', 0, 'Seed of the resampling.')
+# Named apart from the flags of `evaluation_suite`, which may be linked into
+# the same binary.
+_TAGS_DIRECTORY = flags.DEFINE_string(
+    'tags_directory',
+    'tasks',
+    'Tasks directory to read the tags of the tasks from, to compare the'
+    ' programs of all tasks with a tag together.',
+)
+_REPORT_DIRECTORY = flags.DEFINE_string(
+    'report_directory',
+    None,
+    f'Directory to write `{REPORT_BASENAME}.md` and `{REPORT_BASENAME}.json`'
+    ' to.',
+    required=True,
+)
+
+
+@dataclasses.dataclass(frozen=True)
+class PairedComparison:
+  """The difference in one metric between two runs over a group of programs.
+
+  Attributes:
+    group: The task name or tag.
+    metric: The name of the metric.
+    num_programs: The number of programs present in both runs.
+    baseline_mean: The mean of the metric in the baseline run.
+    candidate_mean: The mean of the metric in the candidate run.
+    delta: `candidate_mean - baseline_mean`.
+    ci_low: Lower end of the bootstrap confidence interval of `delta`.
+    ci_high: Upper end of the bootstrap confidence interval of `delta`.
+    p_value: Two-sided p-value of the permutation test of `delta == 0`.
+  """
+
+  group: str
+  metric: str
+  num_programs: int
+  baseline_mean: float
+  candidate_mean: float
+  delta: float
+  ci_low: float
+  ci_high: float
+  p_value: float
+
+
+@dataclasses.dataclass(frozen=True)
+class _AlignedTask:
+  """Per-program metrics of a task in both runs, in the same program order."""
+
+  metrics: list[str]
+  baseline: np.ndarray
+  candidate: np.ndarray
+  num_baseline_only: int
+  num_candidate_only: int
+  # Metrics that some of the aligned programs lack in either run.
+  dropped_metrics: list[str]
+
+
+def read_program_metrics(
+    run_dir: epath.Path,
+) -> dict[str, dict[str, dict[str, float]]]:
+  """Reads the per-program metrics of a run.
+
+  Args:
+    run_dir: The output directory of an evaluation run.
+
+  Returns:
+    The metrics of each program, keyed by task name and program name.
+  """
+  results = {}
+  for predictions_path in sorted(
+      run_dir.glob(f'*/{task_lib.PREDICTIONS_FILENAME}')
+  ):
+    with open(predictions_path, 'r') as f:
+      results[predictions_path.parent.name] = {
+          record['name']: record['metrics']
+          for record in map(json.loads, f)
+      }
+  return results
+
+
+def read_task_tags(tasks_directory: epath.Path) -> dict[str, list[str]]:
+  """Reads the tags of every task in the tasks directory, keyed by task name."""
+  tags = {}
+  for metadata_path in sorted(
+      tasks_directory.glob(f'*/{task_loader.METADATA_FILENAME}')
+  ):
+    metadata = json.loads(metadata_path.read_text(encoding='utf-8'))
+    tags[metadata['name']] = list(metadata.get('tags', []))
+  return tags
+
+
+def _align(
+    baseline: dict[str, dict[str, float]],
+    candidate: dict[str, dict[str, float]],
+) -> _AlignedTask | None:
+  """Aligns the programs of a task that are present in both runs."""
+  names = sorted(baseline.keys() & candidate.keys())
+  if not names:
+    return None
+  # A run that was rescored after a metric was added has more metrics than
+  # one that was not, so only the metrics of every program are compared.
+  metric_sets = [
+      {
+          metric
+          for metric, value in program_metrics[name].items()
+          if isinstance(value, (int, float))
+      }
+      for program_metrics in (baseline, candidate)
+      for name in names
+  ]
+  common = set.intersection(*metric_sets)
+  metric_names = [
+      metric for metric in baseline[names[0]] if metric in common
+  ]
+  return _AlignedTask(
+      metrics=metric_names,
+      baseline=np.array(
+          [[baseline[name][m] for m in metric_names] for name in names],
+          dtype=np.float64,
+      ),
+      candidate=np.array(
+          [[candidate[name][m] for m in metric_names] for name in names],
+          dtype=np.float64,
+      ),
+      num_baseline_only=len(baseline.keys() - candidate.keys()),
+      num_candidate_only=len(candidate.keys() - baseline.keys()),
+      dropped_metrics=sorted(set.union(*metric_sets) - common),
+  )
+
+
+def paired_tests(
+    deltas: np.ndarray,
+    num_resamples: int = DEFAULT_NUM_RESAMPLES,
+    rng: np.random.Generator | None = None,
+    confidence: float = DEFAULT_CONFIDENCE,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+  """Tests whether the mean of paired differences is zero.
+
+  The confidence interval is a percentile bootstrap over programs. The p-value
+  is from a sign-flip permutation test: under the null hypothesis, the runs
+  are exchangeable within each program, so the sign of each difference is
+  random.
+
+  Args:
+    deltas: The per-program differences, of shape `[num_programs,
+      num_metrics]`.
+    num_resamples: The number of bootstrap resamples and of permutations.
+    rng: The random number generator.
+    confidence: The coverage of the confidence interval.
+
+  Returns:
+    The lower and upper ends of the confidence intervals, and the two-sided
+    p-values, each of shape `[num_metrics]`.
+  """
+  rng = rng or np.random.default_rng()
+  num_programs = len(deltas)
+  observed = deltas.mean(axis=0)
+  total = deltas.sum(axis=0)
+  bootstrap_means = []
+  num_extreme = np.zeros(deltas.shape[1], dtype=np.int64)
+  # Small differences from floating point rounding are not more extreme.
+  tolerance = 1e-12 * np.maximum(1.0, np.abs(observed))
+  block_size = max(1, _MAX_BLOCK_SIZE // num_programs)
+  for start in range(0, num_resamples, block_size):
+    size = min(block_size, num_resamples - start)
+    indices = rng.integers(0, num_programs, size=(size, num_programs))
+    # Summing the draws of each resample through counts keeps this a single
+    # matrix product.
+    counts = np.bincount(
+        (indices + num_programs * np.arange(size)[:, None]).ravel(),
+        minlength=size * num_programs,
+    ).reshape(size, num_programs)
+    bootstrap_means.append(counts @ deltas / num_programs)
+    flipped = (rng.random((size, num_programs)) < 0.5).astype(deltas.dtype)
+    permuted_means = (total - 2 * (flipped @ deltas)) / num_programs
+    num_extreme += np.count_nonzero(
+        np.abs(permuted_means) >= np.abs(observed) - tolerance, axis=0
+    )
+  bootstrap_means = np.concatenate(bootstrap_means)
+  alpha = 1 - confidence
+  ci_low, ci_high = np.quantile(
+      bootstrap_means, [alpha / 2, 1 - alpha / 2], axis=0
+  )
+  p_values = (1 + num_extreme) / (1 + num_resamples)
+  return ci_low, ci_high, p_values
+
+
+def _compare_group(
+    group: str,
+    metric_names: Sequence[str],
+    baseline: np.ndarray,
+    candidate: np.ndarray,
+    num_resamples: int,
+    rng: np.random.Generator,
+) -> list[PairedComparison]:
+  ci_low, ci_high, p_values = paired_tests(
+      candidate - baseline, num_resamples, rng
+  )
+  baseline_means = baseline.mean(axis=0)
+  candidate_means = candidate.mean(axis=0)
+  return [
+      PairedComparison(
+          group=group,
+          metric=metric,
+          num_programs=len(baseline),
+          baseline_mean=float(baseline_means[i]),
+          candidate_mean=float(candidate_means[i]),
+          delta=float(candidate_means[i] - baseline_means[i]),
+          ci_low=float(ci_low[i]),
+          ci_high=float(ci_high[i]),
+          p_value=float(p_values[i]),
+      )
+      for i, metric in enumerate(metric_names)
+  ]
+
+
+def compare_runs(
+    baseline_dir: epath.Path,
+    candidate_dir: epath.Path,
+    task_tags: dict[str, list[str]] | None = None,
+    num_resamples: int = DEFAULT_NUM_RESAMPLES,
+    seed: int = 0,
+) -> dict[str, Any]:
+  """Compares the per-program metrics of two runs.
+
+  Args:
+    baseline_dir: The output directory of the baseline run.
+    candidate_dir: The output directory of the candidate run.
+    task_tags: The tags of each task. Programs of tasks with a tag are pooled
+      into a comparison for that tag, if all of those tasks have the same
+      metrics.
+    num_resamples: The number of bootstrap and permutation resamples.
+    seed: The seed of the resampling.
+
+  Returns:
+    A JSON-serializable report with the comparisons of each task and tag, the
+    numbers of programs and tasks that are only present in one run, the
+    metrics of each task that some programs lack in either run, and the
+    different metric sets of each tag whose tasks could not be pooled.
+  """
+  rng = np.random.default_rng(seed)
+  task_tags = task_tags or {}
+  baseline = read_program_metrics(baseline_dir)
+  candidate = read_program_metrics(candidate_dir)
+  task_comparisons = []
+  unmatched_programs = {}
+  uncompared_metrics = {}
+  tagged: dict[str, list[_AlignedTask]] = {}
+  for task_name in sorted(baseline.keys() & candidate.keys()):
+    aligned = _align(baseline[task_name], candidate[task_name])
+    if aligned is None:
+      unmatched_programs[task_name] = {
+          'baseline_only': len(baseline[task_name]),
+          'candidate_only': len(candidate[task_name]),
+      }
+      continue
+    if aligned.num_baseline_only or aligned.num_candidate_only:
+      unmatched_programs[task_name] = {
+          'baseline_only': aligned.num_baseline_only,
+          'candidate_only': aligned.num_candidate_only,
+      }
+    if aligned.dropped_metrics:
+      uncompared_metrics[task_name] = aligned.dropped_metrics
+    if not aligned.metrics:
+      continue
+    task_comparisons.extend(
+        _compare_group(
+            task_name,
+            aligned.metrics,
+            aligned.baseline,
+            aligned.candidate,
+            num_resamples,
+            rng,
+        )
+    )
+    for tag in task_tags.get(task_name, []):
+      tagged.setdefault(tag, []).append(aligned)
+
+  tag_comparisons = []
+  uncompared_tags = {}
+  for tag in sorted(tagged):
+    tasks = tagged[tag]
+    if any(task.metrics != tasks[0].metrics for task in tasks):
+      uncompared_tags[tag] = sorted({tuple(task.metrics) for task in tasks})
+      continue
+    tag_comparisons.extend(
+        _compare_group(
+            tag,
+            tasks[0].metrics,
+            np.concatenate([task.baseline for task in tasks]),
+            np.concatenate([task.candidate for task in tasks]),
+            num_resamples,
+            rng,
+        )
+    )
+  return {
+      'baseline_directory': str(baseline_dir),
+      'candidate_directory': str(candidate_dir),
+      'num_resamples': num_resamples,
+      'confidence': DEFAULT_CONFIDENCE,
+      'tasks': [dataclasses.asdict(c) for c in task_comparisons],
+      'tags': [dataclasses.asdict(c) for c in tag_comparisons],
+      'unmatched_programs': unmatched_programs,
+      'uncompared_metrics': uncompared_metrics,
+      'uncompared_tags': {
+          tag: [list(metrics) for metrics in metric_sets]
+          for tag, metric_sets in uncompared_tags.items()
+      },
+      'baseline_only_tasks': sorted(baseline.keys() - candidate.keys()),
+      'candidate_only_tasks': sorted(candidate.keys() - baseline.keys()),
+  }
+
+
+def _format_table(sb: io.StringIO, comparisons: Sequence[dict[str, Any]]):
+  sb.write(
+      '| group | metric | n | baseline | candidate | delta | 95% CI | p |\n'
+      '|---|---|---|---|---|---|---|---|\n'
+  )
+  for c in comparisons:
+    sb.write(
+        f"| {c['group']} | {c['metric']} | {c['num_programs']} |"
+        f" {c['baseline_mean']:.3f} | {c['candidate_mean']:.3f} |"
+        f" {c['delta']:+.3f} | [{c['ci_low']:+.3f}, {c['ci_high']:+.3f}] |"
+        f" {c['p_value']:.3f} |\n"
+    )
+
+
+def format_report(report: dict[str, Any]) -> str:
+  """Formats a report of `compare_runs` as Markdown."""
+  with io.StringIO() as sb:
+    sb.write(
+        f"# {report['candidate_directory']} vs."
+        f" {report['baseline_directory']}\n\n"
+        'Deltas are candidate minus baseline, over the programs present in'
+        ' both runs, with paired bootstrap confidence intervals and sign-flip'
+        f" permutation p-values ({report['num_resamples']} resamples).\n"
+    )
+    sb.write('\n## Tasks\n\n')
+    _format_table(sb, report['tasks'])
+    if report['tags']:
+      sb.write('\n## Tags\n\n')
+      _format_table(sb, report['tags'])
+    if (
+        report['unmatched_programs']
+        or report['uncompared_metrics']
+        or report['uncompared_tags']
+        or report['baseline_only_tasks']
+        or report['candidate_only_tasks']
+    ):
+      sb.write('\n## Not compared\n\n')
+      for task_name, counts in report['unmatched_programs'].items():
+        sb.write(
+            f"* {task_name}: {counts['baseline_only']} programs only in the"
+            f" baseline, {counts['candidate_only']} only in the candidate\n"
+        )
+      for task_name, metrics in report['uncompared_metrics'].items():
+        sb.write(
+            f"* {task_name}: {', '.join(metrics)} not in every program of"
+            ' both runs\n'
+        )
+      for tag, metric_sets in report['uncompared_tags'].items():
+        formatted = '; '.join(', '.join(metrics) for metrics in metric_sets)
+        sb.write(
+            f'* tag {tag}: its tasks have different metrics ({formatted})\n'
+        )
+      for task_name in report['baseline_only_tasks']:
+        sb.write(f'* {task_name}: only in the baseline\n')
+      for task_name in report['candidate_only_tasks']:
+        sb.write(f'* {task_name}: only in the candidate\n')
+    return sb.getvalue()
+
+
+def write_report(output_dir: epath.Path, report: dict[str, Any]) -> None:
+  output_dir.mkdir(parents=True, exist_ok=True)
+  with open(output_dir / f'{REPORT_BASENAME}.md', 'w') as f:
+    f.write(format_report(report))
+  with open(output_dir / f'{REPORT_BASENAME}.json', 'w') as f:
+    json.dump(report, f, indent=2)
+
+
+def main(argv: Sequence[str]) -> None:
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+  # Tasks that are no longer in the tasks directory are only compared
+  # individually.
+  tasks_directory = epath.Path(_TAGS_DIRECTORY.value)
+  task_tags = {}
+  if tasks_directory.exists():
+    task_tags = read_task_tags(tasks_directory)
+  report = compare_runs(
+      epath.Path(_BASELINE_DIRECTORY.value),
+      epath.Path(_CANDIDATE_DIRECTORY.value),
+      task_tags,
+      _NUM_RESAMPLES.value,
+      _SEED.value,
+  )
+  write_report(epath.Path(_REPORT_DIRECTORY.value), report)
+  print(format_report(report))
+
+
+if __name__ == '__main__':
+  app.run(main)
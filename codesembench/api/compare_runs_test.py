@@ -0,0 +1,179 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for compare_runs."""
+
+import json
+
+from etils import epath
+import numpy as np
+
+from codesembench.api import compare_runs
+from codesembench.api import evaluation_suite
+from codesembench.api import task_lib
+from codesembench.api import test_utils
+
+
+def _write_run(run_dir, task_name, scores, metric="f1"):
+  task_dir = run_dir / task_name
+  task_dir.mkdir(parents=True, exist_ok=True)
+  with open(task_dir / task_lib.PREDICTIONS_FILENAME, "w") as f:
+    for i, score in enumerate(scores):
+      f.write(
+          json.dumps({
+              "name": f"p{i}.c",
+              "completion": "",
+              "prediction": None,
+              "metrics": {metric: score},
+          })
+          + "\n"
+      )
+
+
+def test_paired_tests_detect_shift():
+  rng = np.random.default_rng(0)
+  deltas = rng.normal(0.1, 0.2, size=(2000, 1))
+  ci_low, ci_high, p_values = compare_runs.paired_tests(deltas, 500, rng)
+  assert 0 < ci_low[0] < 0.1 < ci_high[0]
+  assert p_values[0] < 0.01
+
+
+def test_paired_tests_without_differences():
+  ci_low, ci_high, p_values = compare_runs.paired_tests(
+      np.zeros((100, 2)), 200, np.random.default_rng(0)
+  )
+  np.testing.assert_array_equal(ci_low, [0, 0])
+  np.testing.assert_array_equal(ci_high, [0, 0])
+  np.testing.assert_array_equal(p_values, [1, 1])
+
+
+def test_compare_runs_per_task_and_tag(tmp_path):
+  baseline_dir = epath.Path(tmp_path / "baseline")
+  candidate_dir = epath.Path(tmp_path / "candidate")
+  rng = np.random.default_rng(0)
+  scores = rng.uniform(0, 0.5, size=300)
+  _write_run(baseline_dir, "better", scores)
+  _write_run(candidate_dir, "better", scores + 0.3)
+  _write_run(baseline_dir, "same", scores)
+  _write_run(candidate_dir, "same", scores[:-1])
+  _write_run(baseline_dir, "dropped", scores)
+
+  report = compare_runs.compare_runs(
+      baseline_dir,
+      candidate_dir,
+      {"better": ["c"], "same": ["c", "python"]},
+      num_resamples=200,
+  )
+  tasks = {c["group"]: c for c in report["tasks"]}
+  assert np.isclose(tasks["better"]["delta"], 0.3)
+  assert tasks["better"]["p_value"] < 0.01
+  assert tasks["same"]["num_programs"] == 299
+  assert tasks["same"]["delta"] == 0.0
+  assert tasks["same"]["p_value"] == 1.0
+  tags = {c["group"]: c for c in report["tags"]}
+  assert tags["c"]["num_programs"] == 599
+  assert np.isclose(tags["c"]["delta"], 0.3 * 300 / 599)
+  assert tags["python"]["delta"] == 0.0
+  assert report["unmatched_programs"] == {
+      "same": {"baseline_only": 1, "candidate_only": 0}
+  }
+  assert report["baseline_only_tasks"] == ["dropped"]
+
+  compare_runs.write_report(candidate_dir, report)
+  markdown = (candidate_dir / "comparison.md").read_text()
+  assert "## Tags" in markdown
+  assert "| better | f1 | 300 |" in markdown
+  assert "* dropped: only in the baseline" in markdown
+  assert json.loads((candidate_dir / "comparison.json").read_text()) == report
+
+
+def test_tags_over_different_metrics_are_reported(tmp_path):
+  baseline_dir = epath.Path(tmp_path / "baseline")
+  candidate_dir = epath.Path(tmp_path / "candidate")
+  scores = np.linspace(0, 1, 20)
+  for run_dir in (baseline_dir, candidate_dir):
+    _write_run(run_dir, "prf", scores)
+    _write_run(run_dir, "cluster", scores, metric="cluster_f1")
+  # The programs of a task may have been renamed between the runs.
+  _write_run(baseline_dir, "renamed", scores[:2])
+  (candidate_dir / "renamed").mkdir()
+  (candidate_dir / "renamed" / task_lib.PREDICTIONS_FILENAME).write_text(
+      json.dumps({"name": "other.c", "metrics": {"f1": 1.0}}) + "\n"
+  )
+
+  report = compare_runs.compare_runs(
+      baseline_dir,
+      candidate_dir,
+      {"prf": ["c"], "cluster": ["c"]},
+      num_resamples=10,
+  )
+  assert report["tags"] == []
+  assert report["uncompared_tags"] == {"c": [["cluster_f1"], ["f1"]]}
+  assert report["unmatched_programs"]["renamed"] == {
+      "baseline_only": 2,
+      "candidate_only": 1,
+  }
+  markdown = compare_runs.format_report(report)
+  assert "* tag c: its tasks have different metrics (cluster_f1; f1)" in (
+      markdown
+  )
+
+
+def test_metrics_missing_from_one_run_are_reported(tmp_path):
+  baseline_dir = epath.Path(tmp_path / "baseline")
+  candidate_dir = epath.Path(tmp_path / "candidate")
+  _write_run(baseline_dir, "task", [0.5, 0.5])
+  (candidate_dir / "task").mkdir(parents=True)
+  # The candidate was rescored after a metric was added.
+  (candidate_dir / "task" / task_lib.PREDICTIONS_FILENAME).write_text(
+      "".join(
+          json.dumps({"name": f"p{i}.c", "metrics": {"f1": 1.0, "new": 1.0}})
+          + "\n"
+          for i in range(2)
+      )
+  )
+
+  report = compare_runs.compare_runs(
+      baseline_dir, candidate_dir, num_resamples=10
+  )
+  assert [c["metric"] for c in report["tasks"]] == ["f1"]
+  assert report["uncompared_metrics"] == {"task": ["new"]}
+  assert "* task: new not in every program of both runs" in (
+      compare_runs.format_report(report)
+  )
+
+
+def test_compare_identical_runs(tmp_path):
+  run_dirs = []
+  for name in ("a", "b"):
+    run_dir = epath.Path(tmp_path / name)
+    evaluation_suite.load_evaluation_suite(
+        test_utils.get_tasks_path(), test_utils.MockLlm(), run_dir
+    ).run_suite(None)
+    run_dirs.append(run_dir)
+  report = compare_runs.compare_runs(
+      *run_dirs,
+      compare_runs.read_task_tags(test_utils.get_tasks_path()),
+      num_resamples=100,
+  )
+  assert {c["group"] for c in report["tasks"]} == {
+      "simple_c_alias",
+      "simple_c_escape",
+  }
+  assert {c["group"] for c in report["tags"]} == {"alias", "escape"}
+  for comparison in report["tasks"] + report["tags"]:
+    assert comparison["delta"] == 0.0
+    assert comparison["p_value"] == 1.0
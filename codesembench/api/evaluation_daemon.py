@@ -0,0 +1,321 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Long-running server that evaluates jobs against preloaded tasks.
+
+Running `evaluation_suite.py` pays for process startup, task loading and
+connection setup every time. The daemon does this once: it keeps the tasks
+loaded and runs every job on the same event loop, so the connections of the
+LLM client stay warm between jobs. A background thread polls the tasks
+directory and reloads only the tasks whose files changed.
+
+Jobs are submitted over HTTP:
+
+  * `GET /tasks` lists the loaded tasks.
+  * `POST /evaluate` with a JSON body `{"run_name": ..., "tasks": [...]}` runs
+    the given tasks (all tasks if omitted) and writes the results to
+    `<output_directory>/<run_name>`. The response contains the summary.
+"""
+
+import asyncio
+from collections.abc import Sequence
+import datetime
+import http.server
+import json
+import threading
+from typing import Any
+
+from absl import app
+from absl import flags
+from absl import logging
+from etils import epath
+
+from codesembench.api import evaluation_suite
+from codesembench.api import sharding
+from codesembench.api import task_lib
+from codesembench.api import task_loader
+
+_HOST = flags.DEFINE_string(
+    'host', '127.0.0.1', 'Address for the daemon to listen on.'
+)
+_PORT = flags.DEFINE_integer('port', 8765, 'Port for the daemon to listen on.')
+_POLL_INTERVAL = flags.DEFINE_float(
+    'poll_interval',
+    2.0,
+    'Seconds between checks of the tasks directory for changes.',
+)
+
+FLAGS = flags.FLAGS
+
+# Identifies the contents of a task directory: (path, mtime, size) per file.
+_Signature = tuple[tuple[str, float, int], ...]
+
+
+def _directory_signature(path: epath.Path) -> _Signature:
+  entries = []
+  for directory, _, filenames in path.walk():
+    for filename in filenames:
+      if filename.startswith('.'):
+        # Hidden files, e.g., manifests and caches written by the loader.
+        continue
+      file_path = directory / filename
+      stat = file_path.stat()
+      entries.append(
+          (str(file_path.relative_to(path)), stat.mtime, stat.length)
+      )
+  return tuple(sorted(entries))
+
+
+class EvaluationDaemon:
+  """Keeps tasks loaded and runs evaluation jobs on a persistent event loop.
+
+  The options of the jobs are those of `evaluation_suite.EvaluationSuite`.
+  Note that `max_concurrency` limits the requests of each job, so jobs that
+  run at the same time add up.
+
+  Attributes:
+    tasks_directory: The directory the tasks are loaded from.
+    output_directory: The directory under which each job writes its results.
+  """
+
+  def __init__(
+      self,
+      tasks_directory: epath.Path,
+      llm: task_lib.LlmInterface,
+      output_directory: epath.Path,
+      max_concurrency: int | None = None,
+      num_workers: int = 1,
+      use_uvloop: bool = False,
+      queue_size: int = task_lib.DEFAULT_QUEUE_SIZE,
+  ):
+    self.tasks_directory = tasks_directory
+    self.output_directory = output_directory
+    self._llm = llm
+    self._max_concurrency = max_concurrency
+    self._num_workers = num_workers
+    self._use_uvloop = use_uvloop
+    self._queue_size = queue_size
+    # Maps task directories to their signature and loaded task.
+    self._tasks: dict[epath.Path, tuple[_Signature, task_lib.Task]] = {}
+    self._tasks_lock = threading.Lock()
+    self._loop = sharding.new_event_loop(use_uvloop)
+    self._loop_thread = threading.Thread(
+        target=self._loop.run_forever, daemon=True
+    )
+    self._loop_thread.start()
+    self._stop_watching = threading.Event()
+    self._watch_thread = None
+    self.refresh_tasks()
+
+  def refresh_tasks(self) -> list[str]:
+    """Reloads the tasks that were added or changed since the last refresh.
+
+    Tasks whose directory no longer has a metadata file are dropped.
+
+    Returns:
+      The names of the tasks that were (re)loaded.
+    """
+    task_dirs = [
+        metadata_path.parent
+        for metadata_path in sorted(
+            self.tasks_directory.glob(f'*/{task_loader.METADATA_FILENAME}')
+        )
+    ]
+    reloaded = []
+    new_tasks = {}
+    for task_dir in task_dirs:
+      signature = _directory_signature(task_dir)
+      previous = self._tasks.get(task_dir)
+      if previous is not None and previous[0] == signature:
+        new_tasks[task_dir] = previous
+        continue
+      try:
+        task = task_loader.load_one_task(task_dir)
+      except Exception:  # pylint: disable=broad-exception-caught
+        # Keep serving the last good version while a task is being edited.
+        logging.exception('Could not load task from %s', task_dir)
+        if previous is not None:
+          new_tasks[task_dir] = previous
+        continue
+      new_tasks[task_dir] = (signature, task)
+      reloaded.append(task.name)
+    with self._tasks_lock:
+      self._tasks = new_tasks
+    if reloaded:
+      logging.info('Loaded tasks: %s', ', '.join(reloaded))
+    return reloaded
+
+  @property
+  def tasks(self) -> list[task_lib.Task]:
+    with self._tasks_lock:
+      return [task for _, task in self._tasks.values()]
+
+  def start_watching(self, poll_interval: float) -> None:
+    """Starts a background thread that periodically refreshes the tasks."""
+
+    def watch():
+      while not self._stop_watching.wait(poll_interval):
+        self.refresh_tasks()
+
+    self._watch_thread = threading.Thread(target=watch, daemon=True)
+    self._watch_thread.start()
+
+  def evaluate(
+      self, run_name: str, evals_to_run: set[str] | None = None
+  ) -> dict[str, Any]:
+    """Runs an evaluation job and waits for it to finish.
+
+    This may be called from any thread; the job itself runs on the daemon's
+    event loop.
+
+    Args:
+      run_name: The name of the subdirectory of the output directory to write
+        the results to.
+      evals_to_run: The names of the tasks to run or `None` to run them all.
+
+    Returns:
+      The summary of the results, keyed by task name.
+    """
+    tasks = self.tasks
+    if evals_to_run is not None:
+      unknown = evals_to_run - {task.name for task in tasks}
+      if unknown:
+        raise ValueError(f'Unknown tasks: {sorted(unknown)}')
+    suite = evaluation_suite.EvaluationSuite(
+        self._llm,
+        tasks,
+        self.output_directory / run_name,
+        self._max_concurrency,
+        self._num_workers,
+        self._use_uvloop,
+        self._queue_size,
+    )
+    future = asyncio.run_coroutine_threadsafe(
+        suite.run_suite_async(evals_to_run), self._loop
+    )
+    return future.result()
+
+  def close(self) -> None:
+    """Stops watching the tasks, closes the LLM client and the event loop."""
+    self._stop_watching.set()
+    if self._watch_thread is not None:
+      self._watch_thread.join()
+    aclose = getattr(self._llm, 'aclose', None)
+    if aclose is not None:
+      asyncio.run_coroutine_threadsafe(aclose(), self._loop).result()
+    self._loop.call_soon_threadsafe(self._loop.stop)
+    self._loop_thread.join()
+    self._loop.close()
+
+
+class _DaemonRequestHandler(http.server.BaseHTTPRequestHandler):
+  """Translates HTTP requests into calls on the `EvaluationDaemon`."""
+
+  server: 'DaemonServer'
+
+  def _send_json(self, status: int, payload: Any) -> None:
+    body = json.dumps(payload).encode('utf-8')
+    self.send_response(status)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):  # pylint: disable=invalid-name
+    if self.path != '/tasks':
+      self._send_json(404, {'error': f'Unknown path: {self.path}'})
+      return
+    self._send_json(
+        200, {'tasks': sorted(task.name for task in self.server.daemon.tasks)}
+    )
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    if self.path != '/evaluate':
+      self._send_json(404, {'error': f'Unknown path: {self.path}'})
+      return
+    try:
+      length = int(self.headers.get('Content-Length', 0))
+      job = json.loads(self.rfile.read(length) or b'{}')
+      run_name = job.get('run_name') or datetime.datetime.now().strftime(
+          '%Y%m%d_%H%M%S_%f'
+      )
+      if not run_name.isidentifier():
+        raise ValueError(
+            f'Invalid run name: `{run_name}`. Must be a valid'
+            ' identifier/filename.'
+        )
+      evals_to_run = set(job['tasks']) if job.get('tasks') else None
+    except (ValueError, TypeError, AttributeError) as e:
+      self._send_json(400, {'error': str(e)})
+      return
+    try:
+      results = self.server.daemon.evaluate(run_name, evals_to_run)
+    except ValueError as e:
+      self._send_json(400, {'error': str(e)})
+      return
+    except Exception as e:  # pylint: disable=broad-exception-caught
+      logging.exception('Evaluation job %s failed', run_name)
+      self._send_json(500, {'error': str(e)})
+      return
+    output_directory = self.server.daemon.output_directory / run_name
+    self._send_json(
+        200, {'output_directory': str(output_directory), 'results': results}
+    )
+
+  def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+    logging.info(format, *args)
+
+
+class DaemonServer(http.server.ThreadingHTTPServer):
+  """HTTP front end of an `EvaluationDaemon`."""
+
+  daemon_threads = True
+
+  def __init__(self, address: tuple[str, int], daemon: EvaluationDaemon):
+    super().__init__(address, _DaemonRequestHandler)
+    self.daemon = daemon
+
+
+def main(argv: Sequence[str]) -> None:
+  if len(argv) > 1:
+    raise app.UsageError('Too many command-line arguments.')
+  for flag_name in ('profile', 'rescore'):
+    if FLAGS[flag_name].value:
+      raise app.UsageError(
+          f'--{flag_name} is not supported by the daemon. Use'
+          ' evaluation_suite.py instead.'
+      )
+  daemon = EvaluationDaemon(
+      epath.Path(FLAGS.tasks_directory),
+      evaluation_suite.llm_from_flags(),
+      epath.Path(FLAGS.output_directory),
+      FLAGS.max_concurrency,
+      FLAGS.num_workers,
+      FLAGS.uvloop,
+      FLAGS.queue_size,
+  )
+  daemon.start_watching(_POLL_INTERVAL.value)
+  server = DaemonServer((_HOST.value, _PORT.value), daemon)
+  logging.info('Serving on %s:%d', *server.server_address[:2])
+  try:
+    server.serve_forever()
+  finally:
+    server.server_close()
+    daemon.close()
+
+
+if __name__ == '__main__':
+  app.run(main)
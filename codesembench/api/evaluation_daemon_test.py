@@ -0,0 +1,124 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for evaluation_daemon."""
+
+import json
+import shutil
+import threading
+import urllib.error
+import urllib.request
+
+from etils import epath
+import pytest
+
+from codesembench.api import evaluation_daemon
+from codesembench.api import test_utils
+
+
+@pytest.fixture
+def daemon(tmp_path):
+  tasks_dir = tmp_path / "tasks"
+  shutil.copytree(test_utils.get_tasks_path(), tasks_dir)
+  daemon = evaluation_daemon.EvaluationDaemon(
+      epath.Path(tasks_dir),
+      test_utils.MockLlm(),
+      epath.Path(tmp_path / "output"),
+  )
+  yield daemon
+  daemon.close()
+
+
+def test_evaluate_reuses_loaded_tasks(daemon):
+  first = daemon.evaluate("run1")
+  second = daemon.evaluate("run2", {"simple_c_alias"})
+  assert first["simple_c_alias"] == second["simple_c_alias"]
+  assert set(second) == {"simple_c_alias"}
+  assert (daemon.output_directory / "run2" / "eval_summary.md").exists()
+
+
+def test_refresh_reloads_only_changed_tasks(daemon):
+  tasks_before = {task.name: task for task in daemon.tasks}
+  assert daemon.refresh_tasks() == []
+
+  answer_path = (
+      daemon.tasks_directory / "simple_c_alias" / "answers" / "alias1.c"
+  )
+  answer_path.write_text('[["p", "m0", "m1"]]')
+  assert daemon.refresh_tasks() == ["simple_c_alias"]
+
+  tasks_after = {task.name: task for task in daemon.tasks}
+  assert tasks_after["simple_c_escape"] is tasks_before["simple_c_escape"]
+  assert tasks_after["simple_c_alias"] is not tasks_before["simple_c_alias"]
+
+
+def test_unknown_task_is_rejected(daemon):
+  with pytest.raises(ValueError, match="Unknown tasks"):
+    daemon.evaluate("run", {"no_such_task"})
+
+
+def test_http_api(daemon):
+  server = evaluation_daemon.DaemonServer(("127.0.0.1", 0), daemon)
+  thread = threading.Thread(target=server.serve_forever, daemon=True)
+  thread.start()
+  host, port = server.server_address[:2]
+  try:
+    with urllib.request.urlopen(f"http://{host}:{port}/tasks") as response:
+      assert json.load(response)["tasks"] == [
+          "simple_c_alias",
+          "simple_c_escape",
+      ]
+    request = urllib.request.Request(
+        f"http://{host}:{port}/evaluate",
+        data=json.dumps(
+            {"run_name": "job", "tasks": ["simple_c_alias"]}
+        ).encode("utf-8"),
+        method="POST",
+    )
+    with urllib.request.urlopen(request) as response:
+      job = json.load(response)
+    assert job["results"]["simple_c_alias"]["f1"] == pytest.approx(
+        0.638886, abs=1e-3
+    )
+    bad_request = urllib.request.Request(
+        f"http://{host}:{port}/evaluate",
+        data=json.dumps({"run_name": "../job"}).encode("utf-8"),
+        method="POST",
+    )
+    with pytest.raises(urllib.error.HTTPError) as e:
+      urllib.request.urlopen(bad_request)
+    assert e.value.code == 400
+  finally:
+    server.shutdown()
+    server.server_close()
+
+
+def test_jobs_use_worker_processes(tmp_path):
+  daemon = evaluation_daemon.EvaluationDaemon(
+      test_utils.get_tasks_path(),
+      test_utils.MockLlm(),
+      epath.Path(tmp_path / "output"),
+      max_concurrency=2,
+      num_workers=2,
+  )
+  try:
+    daemon.evaluate("run")
+  finally:
+    daemon.close()
+  report = json.loads(
+      (daemon.output_directory / "run" / "scheduling_report.json").read_text()
+  )
+  assert len(report["workers"]) == 2
@@ -19,17 +19,25 @@
 import abc
 import asyncio
 from collections.abc import Sequence
+import contextlib
 import io
 import json
+from typing import Any
 
 from absl import app
 from absl import flags
+from absl import logging
 from etils import epath
 import rich
 import rich.console
 import rich.markdown
 import rich.progress
 
+from codesembench.api import http_llm
+from codesembench.api import profiler
+from codesembench.api import rescoring
+from codesembench.api import scheduler
+from codesembench.api import sharding
 from codesembench.api import task_lib
 from codesembench.api import task_loader
 
@@ -39,6 +47,71 @@ _TASKS_DIRECTORY = flags.DEFINE_string(
 _OUTPUT_DIRECTORY = flags.DEFINE_string(
     'output_directory', None, 'Path to write the output to.', required=True
 )
+_MAX_CONCURRENCY = flags.DEFINE_integer(
+    'max_concurrency',
+    None,
+    'Maximum number of concurrent LLM requests. If set, requests are started'
+    ' in descending order of estimated cost. If unset, each task has up to'
+    ' --queue_size requests in flight at a time.',
+)
+_PROFILE = flags.DEFINE_bool(
+    'profile',
+    False,
+    'Whether to profile the CPU and memory use of each phase of the'
+    f' evaluation, and write the report to `{profiler.REPORT_FILENAME}` in the'
+    ' output directory.',
+)
+_RESCORE = flags.DEFINE_bool(
+    'rescore',
+    False,
+    'Instead of querying the LLM, rescore the predictions stored in'
+    ' --output_directory against the current tasks and metrics, and rewrite'
+    ' its summaries. The last component of --output_directory may be a glob'
+    ' pattern to rescore several runs, e.g., `runs/*`.',
+)
+_NUM_WORKERS = flags.DEFINE_integer(
+    'num_workers',
+    1,
+    'Number of worker processes to query the LLM from, each with its own'
+    ' event loop and an even share of --max_concurrency. Also used for'
+    ' rescoring.',
+)
+_QUEUE_SIZE = flags.DEFINE_integer(
+    'queue_size',
+    task_lib.DEFAULT_QUEUE_SIZE,
+    'Capacity of the queues between the load, generate and score stages of'
+    ' each task. This bounds the memory use and the number of requests in'
+    ' flight per task, unless --max_concurrency is set, in which case all'
+    ' programs are read up front so that their requests can be scheduled.',
+)
+_UVLOOP = flags.DEFINE_bool(
+    'uvloop',
+    False,
+    'Whether to run the event loops on uvloop. Requires the `uvloop` package.',
+)
+_LLM_URL = flags.DEFINE_string(
+    'llm_url',
+    None,
+    'HTTP endpoint of the LLM to evaluate. If unset, a null LLM is used.',
+)
+_LLM_SCHEMA = flags.DEFINE_enum(
+    'llm_schema',
+    'completions',
+    list(http_llm.SCHEMAS),
+    'Request/response schema of the HTTP endpoint.',
+)
+_LLM_MODEL = flags.DEFINE_string(
+    'llm_model', None, 'Model name to send in completion requests.'
+)
+_LLM_MAX_CONNECTIONS = flags.DEFINE_integer(
+    'llm_max_connections', 100, 'Size of the HTTP connection pool.'
+)
+_LLM_HTTP2 = flags.DEFINE_bool(
+    'llm_http2', False, 'Whether to use HTTP/2 to talk to the endpoint.'
+)
+_LLM_COMPRESS_REQUESTS = flags.DEFINE_bool(
+    'llm_compress_requests', False, 'Whether to gzip request bodies.'
+)
 
 
 class NullLlm(task_lib.LlmInterface):
@@ -65,6 +138,14 @@ class ProgressBar(abc.ABC):
     """Sets the state of the progress bar."""
 
 
+def _read_all_programs(task: task_lib.PropertyPredictionTask) -> None:
+  """Reads the programs of a task that streams them into its `data`."""
+  if task.program_source is not None:
+    with profiler.phase('load_tasks'):
+      task.data = list(task.program_source())
+    task.program_source = None
+
+
 class EvaluationSuite:
   """A suite knows how to run a set of evaluation tasks and collect results.
 
@@ -77,6 +158,16 @@ class EvaluationSuite:
     llm: The LLM to use for evaluation.
     output_dir: The directory to write the results to.
     tasks: A list of task_lib.Task objects to run.
+    max_concurrency: If set, the maximum number of concurrent LLM requests.
+      Requests are then ordered by `scheduler.ScheduledLlm`, and a report of
+      the predicted and actual makespan is written to the output directory.
+      For the scheduler to see all requests, the programs are then read before
+      the tasks start, and `queue_size` does not limit the requests.
+    num_workers: The number of processes to query the LLM from. With more than
+      one, the programs are split between `sharding` workers, and the
+      predictions are scored in this process.
+    use_uvloop: Whether to run the event loops on uvloop.
+    queue_size: The capacity of the queues between the stages of each task.
   """
 
   def __init__(
@@ -84,8 +175,16 @@ class EvaluationSuite:
       llm: task_lib.LlmInterface,
       tasks: Sequence[task_lib.Task],
       output_dir: epath.Path,
+      max_concurrency: int | None = None,
+      num_workers: int = 1,
+      use_uvloop: bool = False,
+      queue_size: int = task_lib.DEFAULT_QUEUE_SIZE,
   ):
     self._llm = llm
+    self._queue_size = queue_size
+    self._max_concurrency = max_concurrency
+    self._num_workers = num_workers
+    self._use_uvloop = use_uvloop
     output_dir.mkdir(parents=True, exist_ok=True)
     self._output_dir = output_dir
 
@@ -102,68 +201,316 @@ class EvaluationSuite:
 
   async def _run_all(self, evals_to_run: set[str] | None):
     """Runs all evaluation tasks."""
+    task_names = []
+    for task_name in self._tasks:
+      if evals_to_run is not None and task_name not in evals_to_run:
+        continue
+      (self._output_dir / task_name).mkdir(exist_ok=True)
+      task_names.append(task_name)
+
+    lag_sampler = None
+    if (phase_profiler := profiler.active()) is not None:
+      lag_sampler = asyncio.create_task(phase_profiler.sample_event_loop_lag())
+    try:
+      if self._num_workers > 1:
+        results, scheduling_report = await self._run_in_workers(task_names)
+      else:
+        results, scheduling_report = await self._run_in_process(task_names)
+    finally:
+      if lag_sampler is not None:
+        lag_sampler.cancel()
+
+    with profiler.phase('render'):
+      markdown_text, all_results = self._render_summary(task_names, results)
+
+    if scheduling_report is not None:
+      with open(self._output_dir / 'scheduling_report.json', 'w') as f:
+        json.dump(scheduling_report, f, indent=2)
+
+    return markdown_text, all_results
+
+  async def _run_in_process(
+      self, task_names: Sequence[str]
+  ) -> tuple[list[dict[str, Any]], dict[str, Any] | None]:
+    """Runs the tasks in the current event loop."""
+    llm = self._llm
+    queue_sizes = {task_name: self._queue_size for task_name in task_names}
+    if self._max_concurrency is not None:
+      llm = scheduler.ScheduledLlm(llm, self._max_concurrency)
+      # The scheduler can only order the requests that it holds, so every
+      # program is submitted at once rather than through bounded queues.
+      for task_name in task_names:
+        task = self._tasks[task_name]
+        if isinstance(task, task_lib.PropertyPredictionTask):
+          _read_all_programs(task)
+          queue_sizes[task_name] = max(self._queue_size, len(task.data))
     with rich.progress.Progress() as progress:
-      all_tasks = []
-      task_names = []
-      for task_name, task in self._tasks.items():
-        if evals_to_run is not None and task_name not in evals_to_run:
-          continue
-        task_log_dir = self._output_dir / task_name
-        task_log_dir.mkdir(exist_ok=True)
-        all_tasks.append(task.run(self._llm, task_log_dir, progress))
-        task_names.append(task_name)
-      results = await asyncio.gather(*all_tasks)
-
-    all_results = {}
-    with io.StringIO() as sb:
-      for task_name, task_results in zip(task_names, results):
-        # TODO(mallamanis): Later combine in a more visually pleasing way.
-        sb.write(f'\n## {task_name}\n\n')
-        all_results[task_name] = task_results
-        for metric_name, metric_value in task_results.items():
-          if isinstance(metric_value, float):
-            sb.write(f'* {metric_name}: {metric_value:.3f}\n')
-          else:
-            sb.write(f'* {metric_name}: {metric_value}\n')
-      markdown_text = sb.getvalue()
+      with profiler.phase('dispatch'):
+        results = await asyncio.gather(*[
+            self._tasks[task_name].run(
+                llm,
+                self._output_dir / task_name,
+                progress,
+                queue_sizes[task_name],
+            )
+            for task_name in task_names
+        ])
+    scheduling_report = None
+    if isinstance(llm, scheduler.ScheduledLlm):
+      scheduling_report = llm.makespan_report()
+    return results, scheduling_report
 
+  async def _run_in_workers(
+      self, task_names: Sequence[str]
+  ) -> tuple[list[dict[str, Any]], dict[str, Any] | None]:
+    """Queries the LLM from worker processes and scores in this one."""
+    tasks = [self._tasks[task_name] for task_name in task_names]
+    for task in tasks:
+      if not isinstance(task, task_lib.PropertyPredictionTask):
+        raise ValueError(
+            f'Task `{task.name}` cannot be split between workers.'
+        )
+      # The programs are partitioned up front.
+      _read_all_programs(task)
+    with profiler.phase('dispatch'):
+      predictions, reports = await sharding.predict_in_workers(
+          self._llm,
+          tasks,
+          self._num_workers,
+          self._max_concurrency,
+          self._use_uvloop,
+      )
+    results = [
+        task.summarize(predictions[task.name], self._output_dir / task.name)
+        for task in tasks
+    ]
+    scheduling_report = None
+    if self._max_concurrency is not None:
+      scheduling_report = {'workers': reports}
+    return results, scheduling_report
+
+  def _render_summary(
+      self, task_names: Sequence[str], results: Sequence[dict[str, Any]]
+  ) -> tuple[str, dict[str, Any]]:
+    """Formats the results as Markdown and prints them to the console."""
+    all_results = dict(zip(task_names, results))
+    markdown_text = format_summary(all_results)
     console = rich.console.Console(record=True)
     console.print(markdown_text)
-
     return markdown_text, all_results
 
   def run_suite(self, evals_to_run: set[str] | None):
-    """Runs the evaluation suite.
+    """Runs the evaluation suite in a new event loop.
+
+    The connections of the LLM client belong to that event loop, so they are
+    closed when the suite is done.
 
     Args:
       evals_to_run: A set with the names of the evaluations to run or `None` to
         run them all.
     """
-    summary_text, summary_dict = asyncio.run(self._run_all(evals_to_run))
-    with open(self._output_dir / 'eval_summary.md', 'w') as f:
-      f.write(summary_text)
-    with open(self._output_dir / 'eval_summary.json', 'w') as f:
-      json.dump(summary_dict, f)
+
+    async def run_and_close():
+      try:
+        await self.run_suite_async(evals_to_run)
+      finally:
+        aclose = getattr(self._llm, 'aclose', None)
+        if aclose is not None:
+          await aclose()
+
+    sharding.run_event_loop(run_and_close(), self._use_uvloop)
+
+  async def run_suite_async(
+      self, evals_to_run: set[str] | None
+  ) -> dict[str, Any]:
+    """Runs the evaluation suite in the current event loop.
+
+    Args:
+      evals_to_run: A set with the names of the evaluations to run or `None` to
+        run them all.
+
+    Returns:
+      The summary of the results, keyed by task name.
+    """
+    summary_text, summary_dict = await self._run_all(evals_to_run)
+    write_summary(self._output_dir, summary_text, summary_dict)
+    return summary_dict
+
+
+def format_summary(all_results: dict[str, dict[str, Any]]) -> str:
+  """Formats the results of each task as Markdown."""
+  with io.StringIO() as sb:
+    for task_name, task_results in all_results.items():
+      # TODO(mallamanis): Later combine in a more visually pleasing way.
+      sb.write(f'\n## {task_name}\n\n')
+      for metric_name, metric_value in task_results.items():
+        if isinstance(metric_value, float):
+          sb.write(f'* {metric_name}: {metric_value:.3f}\n')
+        else:
+          sb.write(f'* {metric_name}: {metric_value}\n')
+    return sb.getvalue()
+
+
+def write_summary(
+    output_dir: epath.Path,
+    summary_text: str,
+    summary_dict: dict[str, dict[str, Any]],
+) -> None:
+  with open(output_dir / 'eval_summary.md', 'w') as f:
+    f.write(summary_text)
+  with open(output_dir / 'eval_summary.json', 'w') as f:
+    json.dump(summary_dict, f)
 
 
 def load_evaluation_suite(
     base_path: epath.Path,
     llm: task_lib.LlmInterface,
     output_dir: epath.Path,
+    max_concurrency: int | None = None,
+    num_workers: int = 1,
+    use_uvloop: bool = False,
+    queue_size: int = task_lib.DEFAULT_QUEUE_SIZE,
 ) -> EvaluationSuite:
-  tasks = task_loader.load_tasks(base_path)
-  return EvaluationSuite(llm, tasks, output_dir)
+  """Loads the tasks in the given directory into an evaluation suite.
+
+  In a single process without `max_concurrency`, the programs are read while
+  the tasks run, see `task_loader.load_one_task`. Otherwise they are read up
+  front: worker processes need all programs to partition them, and the
+  scheduler needs all requests to order them.
+
+  Args:
+    base_path: The directory to load the tasks from.
+    llm: The LLM to evaluate.
+    output_dir: The directory to write the results to.
+    max_concurrency: See `EvaluationSuite`.
+    num_workers: See `EvaluationSuite`.
+    use_uvloop: See `EvaluationSuite`.
+    queue_size: See `EvaluationSuite`.
+
+  Returns:
+    The evaluation suite.
+  """
+  with profiler.phase('load_tasks'):
+    tasks = task_loader.load_tasks(
+        base_path,
+        stream_programs=num_workers <= 1 and max_concurrency is None,
+    )
+  return EvaluationSuite(
+      llm,
+      tasks,
+      output_dir,
+      max_concurrency,
+      num_workers,
+      use_uvloop,
+      queue_size,
+  )
+
+
+def rescore_runs(
+    base_path: epath.Path,
+    run_dirs: Sequence[epath.Path],
+    num_workers: int = 1,
+) -> dict[epath.Path, dict[str, Any]]:
+  """Rescores previous runs from their stored predictions.
+
+  The summaries of the runs are rewritten. Tasks in a summary that could not be
+  rescored keep their previous results. The number of programs that were
+  rescored, dropped because they are no longer part of a task, or missing
+  because they were added to a task after the run, is written to
+  `rescore_report.json` in each run directory.
+
+  Args:
+    base_path: The directory to load the current tasks from.
+    run_dirs: Output directories of the runs to rescore.
+    num_workers: Number of processes to rescore in.
+
+  Returns:
+    The new summary of each run.
+  """
+  rescored = rescoring.rescore_runs(base_path, run_dirs, num_workers)
+  summaries = {}
+  for run_dir in run_dirs:
+    summary_path = run_dir / 'eval_summary.json'
+    summary = {}
+    if summary_path.exists():
+      summary = json.loads(summary_path.read_text())
+    report = {}
+    for result in rescored:
+      if result.run_dir != run_dir:
+        continue
+      summary[result.task_name] = result.results
+      report[result.task_name] = {
+          'num_rescored': result.num_rescored,
+          'num_removed': result.num_removed,
+          'num_missing': result.num_missing,
+      }
+      if result.num_removed or result.num_missing:
+        logging.warning(
+            'Rescored %s in %s over different programs than the run: %d'
+            ' removed from the task, %d added to the task without a stored'
+            ' prediction.',
+            result.task_name,
+            run_dir,
+            result.num_removed,
+            result.num_missing,
+        )
+    write_summary(run_dir, format_summary(summary), summary)
+    with open(run_dir / 'rescore_report.json', 'w') as f:
+      json.dump(report, f, indent=2)
+    summaries[run_dir] = summary
+  return summaries
+
+
+def llm_from_flags() -> task_lib.LlmInterface:
+  """Returns the LLM described by the command-line flags."""
+  if _LLM_URL.value is None:
+    return NullLlm()
+  schema_cls = http_llm.SCHEMAS[_LLM_SCHEMA.value]
+  if schema_cls is http_llm.TextGenerationSchema:
+    schema = schema_cls()
+  else:
+    schema = schema_cls(model=_LLM_MODEL.value)
+  return http_llm.HttpLlm(
+      _LLM_URL.value,
+      schema,
+      max_connections=_LLM_MAX_CONNECTIONS.value,
+      http2=_LLM_HTTP2.value,
+      compress_requests=_LLM_COMPRESS_REQUESTS.value,
+  )
 
 
 def main(argv: Sequence[str]) -> None:
   if len(argv) > 1:
     raise app.UsageError('Too many command-line arguments.')
-  suite = load_evaluation_suite(
-      _TASKS_DIRECTORY.value,
-      NullLlm(),
-      _OUTPUT_DIRECTORY.value,
-  )
-  suite.run_suite(None)
+  output_dir = epath.Path(_OUTPUT_DIRECTORY.value)
+  if _RESCORE.value:
+    run_dirs = sorted(
+        run_dir
+        for run_dir in output_dir.parent.glob(output_dir.name)
+        if run_dir.is_dir()
+    )
+    rescore_runs(
+        epath.Path(_TASKS_DIRECTORY.value), run_dirs, _NUM_WORKERS.value
+    )
+    return
+  phase_profiler = profiler.PhaseProfiler() if _PROFILE.value else None
+  with (
+      phase_profiler.activate()
+      if phase_profiler is not None
+      else contextlib.nullcontext()
+  ):
+    suite = load_evaluation_suite(
+        epath.Path(_TASKS_DIRECTORY.value),
+        llm_from_flags(),
+        output_dir,
+        _MAX_CONCURRENCY.value,
+        _NUM_WORKERS.value,
+        _UVLOOP.value,
+        _QUEUE_SIZE.value,
+    )
+    suite.run_suite(None)
+  if phase_profiler is not None:
+    phase_profiler.write_report(output_dir)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,165 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Selects similar programs of a task as few-shot examples.
+
+Programs are embedded as TF-IDF vectors over their identifier tokens, hashed
+into a fixed number of dimensions, and compared by cosine similarity. The
+nearest neighbours of every program are computed once per task with blocked
+matrix products and cached on disk next to the task, keyed by the contents of
+the programs, so that later loads only read the cached table.
+"""
+
+import hashlib
+import re
+from typing import Sequence
+import zlib
+
+from etils import epath
+import numpy as np
+
+from codesembench.api import task_lib
+
+# Cache of the neighbour table, written into the task directory.
+CACHE_FILENAME = '.few_shot_neighbors.npz'
+_CACHE_VERSION = 1
+
+_IDENTIFIER_PATTERN = re.compile(r'\w+')
+_DEFAULT_NUM_DIMENSIONS = 2**10
+_BLOCK_SIZE = 1024
+
+
+def _program_key(program: task_lib.Program) -> str:
+  """Returns a hash of the contents of a program."""
+  if isinstance(program, task_lib.MultiFileProgram):
+    return program.digest
+  source = program.source_code  # pytype: disable=attribute-error
+  return hashlib.sha256(source.encode('utf-8')).hexdigest()
+
+
+def embed(
+    sources: Sequence[str], num_dimensions: int = _DEFAULT_NUM_DIMENSIONS
+) -> np.ndarray:
+  """Returns L2-normalized TF-IDF vectors of the given sources.
+
+  Tokens are hashed with CRC32 rather than Python's `hash`, which is salted per
+  process, so the vectors are deterministic.
+
+  Args:
+    sources: The source code of the programs.
+    num_dimensions: The number of hash buckets.
+
+  Returns:
+    An array of shape `[len(sources), num_dimensions]`.
+  """
+  counts = np.zeros((len(sources), num_dimensions), dtype=np.float32)
+  for i, source in enumerate(sources):
+    buckets = [
+        zlib.crc32(token.encode('utf-8')) % num_dimensions
+        for token in _IDENTIFIER_PATTERN.findall(source)
+    ]
+    counts[i] = np.bincount(buckets, minlength=num_dimensions)
+  document_frequency = np.count_nonzero(counts, axis=0)
+  idf = np.log((1 + len(sources)) / (1 + document_frequency)) + 1
+  vectors = np.log1p(counts) * idf.astype(np.float32)
+  norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+  return vectors / np.maximum(norms, 1e-12)
+
+
+def nearest_neighbors(vectors: np.ndarray, k: int) -> np.ndarray:
+  """Returns the `k` most similar other rows for every row.
+
+  Ties are broken by row index, so the result is deterministic.
+
+  Args:
+    vectors: L2-normalized vectors, one per row.
+    k: The number of neighbours. Rows have fewer neighbours if there are not
+      enough other rows; missing entries are -1.
+
+  Returns:
+    An int array of shape `[len(vectors), k]`, most similar first.
+  """
+  num_rows = len(vectors)
+  neighbors = np.full((num_rows, k), -1, dtype=np.int64)
+  num_neighbors = min(k, num_rows - 1)
+  if num_neighbors <= 0:
+    return neighbors
+  for start in range(0, num_rows, _BLOCK_SIZE):
+    block = vectors[start : start + _BLOCK_SIZE] @ vectors.T
+    block_rows = np.arange(len(block))
+    # Never select the query itself.
+    block[block_rows, start + block_rows] = -np.inf
+    top = np.argpartition(-block, num_neighbors - 1, axis=1)[
+        :, :num_neighbors
+    ]
+    top_similarities = np.take_along_axis(block, top, axis=1)
+    order = np.lexsort((top, -top_similarities), axis=1)
+    neighbors[start : start + len(block), :num_neighbors] = (
+        np.take_along_axis(top, order, axis=1)
+    )
+    # argpartition picks arbitrarily between rows that tie with the k-th
+    # best, so those rows are sorted exactly.
+    kth_best = top_similarities.min(axis=1, keepdims=True)
+    ambiguous = np.count_nonzero(block >= kth_best, axis=1) > num_neighbors
+    for row in np.flatnonzero(ambiguous):
+      similarities = block[row]
+      candidates = np.flatnonzero(similarities >= kth_best[row])
+      candidates = candidates[
+          np.lexsort((candidates, -similarities[candidates]))
+      ]
+      neighbors[start + row, :num_neighbors] = candidates[:num_neighbors]
+  return neighbors
+
+
+def load_or_build_neighbors(
+    programs: Sequence[task_lib.Program],
+    k: int,
+    cache_directory: epath.Path,
+) -> np.ndarray:
+  """Returns the few-shot neighbour table of a task, using the disk cache.
+
+  Args:
+    programs: The programs of the task.
+    k: The number of neighbours per program.
+    cache_directory: The directory to keep the cache file in.
+
+  Returns:
+    An int array of shape `[len(programs), k]`, as for `nearest_neighbors`.
+  """
+  key_hash = hashlib.sha256(f'{_CACHE_VERSION}\0{k}\0'.encode('utf-8'))
+  for program in programs:
+    key_hash.update(_program_key(program).encode('utf-8'))
+  key = key_hash.hexdigest()
+  cache_path = cache_directory / CACHE_FILENAME
+  try:
+    with cache_path.open('rb') as f:
+      cached = np.load(f)
+      if str(cached['key']) == key:
+        return cached['neighbors']
+  except (OSError, ValueError, KeyError):
+    pass
+  sources = [
+      program.source_code  # pytype: disable=attribute-error
+      for program in programs
+  ]
+  neighbors = nearest_neighbors(embed(sources), k)
+  try:
+    with cache_path.open('wb') as f:
+      np.savez(f, key=np.array(key), neighbors=neighbors)
+  except OSError:
+    # The tasks may live on a read-only filesystem.
+    pass
+  return neighbors
@@ -0,0 +1,83 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for few_shot."""
+
+import json
+import shutil
+
+from etils import epath
+import numpy as np
+
+from codesembench.api import few_shot
+from codesembench.api import task_loader
+from codesembench.api import test_utils
+
+_SOURCES = [
+    "int add(int a, int b) { return a + b; }",
+    "int sub(int a, int b) { return a - b; }",
+    "char *copy(char *dst, const char *src) { return strcpy(dst, src); }",
+    "char *join(char *dst, const char *src) { return strcat(dst, src); }",
+]
+
+
+def test_nearest_neighbors_excludes_query():
+  neighbors = few_shot.nearest_neighbors(few_shot.embed(_SOURCES), k=1)
+  np.testing.assert_array_equal(neighbors[:, 0], [1, 0, 3, 2])
+
+
+def test_nearest_neighbors_breaks_ties_by_index():
+  vectors = few_shot.embed(["a", "a", "a", "a"])
+  neighbors = few_shot.nearest_neighbors(vectors, k=2)
+  np.testing.assert_array_equal(neighbors, [[1, 2], [0, 2], [0, 1], [0, 1]])
+
+
+def test_nearest_neighbors_pads_small_tasks():
+  neighbors = few_shot.nearest_neighbors(few_shot.embed(_SOURCES[:2]), k=3)
+  np.testing.assert_array_equal(neighbors, [[1, -1, -1], [0, -1, -1]])
+
+
+def test_few_shot_prompts(tmp_path, monkeypatch):
+  tasks_dir = epath.Path(tmp_path / "tasks")
+  shutil.copytree(test_utils.get_tasks_path(), tasks_dir)
+  task_dir = tasks_dir / "simple_c_alias"
+  metadata = json.loads((task_dir / "metadata.json").read_text())
+  metadata["num_shots"] = 2
+  (task_dir / "metadata.json").write_text(json.dumps(metadata))
+
+  task = task_loader.load_one_task(task_dir)
+  assert (task_dir / few_shot.CACHE_FILENAME).exists()
+  for program in task.data:
+    examples = task.few_shot_examples[program.name]
+    assert len(examples) == 2
+    assert program.name not in [example.name for example in examples]
+    prompt = task.build_prompt(program)
+    assert prompt.endswith(program.source_code)
+    assert prompt.startswith(examples[0].source_code)
+    assert f"{json.dumps(examples[0].gold_answer)}\n[eod]\n\n" in prompt
+
+  # The second load reads the neighbours from the cache.
+  def fail(*args, **kwargs):
+    raise AssertionError("embed should not be called")
+  monkeypatch.setattr(few_shot, "embed", fail)
+  reloaded = task_loader.load_one_task(task_dir)
+  assert {
+      name: [example.name for example in examples]
+      for name, examples in reloaded.few_shot_examples.items()
+  } == {
+      name: [example.name for example in examples]
+      for name, examples in task.few_shot_examples.items()
+  }
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""An LlmInterface that queries a model served behind an HTTP API.
+
+All requests from one `HttpLlm` share a pooled, keep-alive HTTP client, so
+the TCP (and TLS) handshake is paid once per connection rather than once per
+program. The wire format is pluggable through `RequestSchema`, with schemas
+for the common completion APIs provided below.
+"""
+
+import abc
+import asyncio
+import gzip
+import json
+from typing import Any, Sequence
+
+import httpx
+
+from codesembench.api import task_lib
+
+
+class RequestSchema(abc.ABC):
+  """Translates between `LlmInterface.generate` calls and an HTTP API."""
+
+  @abc.abstractmethod
+  def build_request(
+      self,
+      prompt: str,
+      num_samples: int,
+      max_length: int,
+      stop_tokens: Sequence[str],
+  ) -> dict[str, Any]:
+    """Returns the JSON body of the request for a single generate call."""
+
+  @abc.abstractmethod
+  def parse_response(self, response: Any) -> list[str]:
+    """Returns the generated samples from the decoded JSON response."""
+
+
+class CompletionsSchema(RequestSchema):
+  """OpenAI-style `/v1/completions` API."""
+
+  def __init__(self, model: str | None = None):
+    self._model = model
+
+  def build_request(
+      self,
+      prompt: str,
+      num_samples: int,
+      max_length: int,
+      stop_tokens: Sequence[str],
+  ) -> dict[str, Any]:
+    request = {
+        'prompt': prompt,
+        'n': num_samples,
+        'max_tokens': max_length,
+        'stop': list(stop_tokens),
+    }
+    if self._model is not None:
+      request['model'] = self._model
+    return request
+
+  def parse_response(self, response: Any) -> list[str]:
+    return [choice['text'] for choice in response['choices']]
+
+
+class ChatCompletionsSchema(CompletionsSchema):
+  """OpenAI-style `/v1/chat/completions` API.
+
+  The prompt is sent as a single user message.
+  """
+
+  def build_request(
+      self,
+      prompt: str,
+      num_samples: int,
+      max_length: int,
+      stop_tokens: Sequence[str],
+  ) -> dict[str, Any]:
+    request = super().build_request(
+        prompt, num_samples, max_length, stop_tokens
+    )
+    del request['prompt']
+    request['messages'] = [{'role': 'user', 'content': prompt}]
+    return request
+
+  def parse_response(self, response: Any) -> list[str]:
+    return [choice['message']['content'] for choice in response['choices']]
+
+
+class TextGenerationSchema(RequestSchema):
+  """Hugging Face text-generation-inference style `/generate` API.
+
+  This API returns a single sample per request, so `num_samples` > 1 is
+  rejected rather than silently ignored.
+  """
+
+  def build_request(
+      self,
+      prompt: str,
+      num_samples: int,
+      max_length: int,
+      stop_tokens: Sequence[str],
+  ) -> dict[str, Any]:
+    if num_samples != 1:
+      raise ValueError(
+          f'TextGenerationSchema only supports num_samples=1, got {num_samples}'
+      )
+    return {
+        'inputs': prompt,
+        'parameters': {
+            'max_new_tokens': max_length,
+            'stop': list(stop_tokens),
+        },
+    }
+
+  def parse_response(self, response: Any) -> list[str]:
+    if isinstance(response, list):
+      return [r['generated_text'] for r in response]
+    return [response['generated_text']]
+
+
+# Schemas selectable by name, e.g., from a command-line flag.
+SCHEMAS = {
+    'completions': CompletionsSchema,
+    'chat_completions': ChatCompletionsSchema,
+    'text_generation': TextGenerationSchema,
+}
+
+
+class HttpLlm(task_lib.LlmInterface):
+  """Queries an LLM over HTTP using a pooled, keep-alive connection.
+
+  The underlying `httpx.AsyncClient` is created lazily on the first request
+  and is bound to the event loop that made it. If the instance is later used
+  from a different event loop, a fresh client is created. Pickling an
+  `HttpLlm` drops the client, so instances can be sent to worker processes.
+
+  Attributes:
+    url: The endpoint to POST the requests to.
+    schema: Translates generate calls to request bodies and back.
+  """
+
+  def __init__(
+      self,
+      url: str,
+      schema: RequestSchema | None = None,
+      *,
+      headers: dict[str, str] | None = None,
+      max_connections: int = 100,
+      max_keepalive_connections: int = 20,
+      keepalive_expiry: float = 30.0,
+      http2: bool = False,
+      compress_requests: bool = False,
+      timeout: float = 300.0,
+  ):
+    """Initializes the client.
+
+    Args:
+      url: The endpoint to POST the requests to.
+      schema: The request/response schema, `CompletionsSchema` by default.
+      headers: Extra headers to send with every request, e.g., authorization.
+      max_connections: Maximum number of concurrent connections in the pool.
+      max_keepalive_connections: Maximum number of idle connections to keep
+        open for reuse.
+      keepalive_expiry: Seconds an idle connection is kept open.
+      http2: Whether to negotiate HTTP/2. This requires the `h2` package,
+        e.g., `pip install httpx[http2]`.
+      compress_requests: Whether to gzip request bodies.
+      timeout: Timeout in seconds for each request.
+    """
+    self.url = url
+    self.schema = schema or CompletionsSchema()
+    self._headers = dict(headers or {})
+    self._limits = httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_keepalive_connections,
+        keepalive_expiry=keepalive_expiry,
+    )
+    self._http2 = http2
+    self._compress_requests = compress_requests
+    self._timeout = timeout
+    self._client = None
+    self._client_loop = None
+
+  def __getstate__(self) -> dict[str, Any]:
+    state = self.__dict__.copy()
+    state['_client'] = None
+    state['_client_loop'] = None
+    return state
+
+  def _get_client(self) -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    if self._client is None or self._client_loop is not loop:
+      self._client = httpx.AsyncClient(
+          headers=self._headers,
+          limits=self._limits,
+          http2=self._http2,
+          timeout=self._timeout,
+      )
+      self._client_loop = loop
+    return self._client
+
+  def _encode_body(
+      self, request: dict[str, Any]
+  ) -> tuple[bytes, dict[str, str]]:
+    body = json.dumps(request).encode('utf-8')
+    headers = {'Content-Type': 'application/json'}
+    if self._compress_requests:
+      body = gzip.compress(body)
+      headers['Content-Encoding'] = 'gzip'
+    return body, headers
+
+  async def generate(
+      self,
+      prompt: str,
+      num_samples: int,
+      max_length: int,
+      stop_tokens: Sequence[str],
+  ) -> Sequence[str]:
+    request = self.schema.build_request(
+        prompt, num_samples, max_length, stop_tokens
+    )
+    body, headers = self._encode_body(request)
+    response = await self._get_client().post(
+        self.url, content=body, headers=headers
+    )
+    response.raise_for_status()
+    return self.schema.parse_response(response.json())
+
+  async def aclose(self) -> None:
+    """Closes all pooled connections."""
+    if self._client is not None:
+      await self._client.aclose()
+      self._client = None
+      self._client_loop = None
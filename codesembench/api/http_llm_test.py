@@ -0,0 +1,118 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for http_llm."""
+
+import asyncio
+import pickle
+
+from etils import epath
+import pytest
+
+from codesembench.api import evaluation_suite
+from codesembench.api import http_llm
+from codesembench.api import test_utils
+
+
+async def _generate_many(llm, prompts):
+  results = []
+  for prompt in prompts:
+    results.append(await llm.generate(prompt, 1, 16, ["[eod]"]))
+  await llm.aclose()
+  return results
+
+
+def test_requests_reuse_one_connection():
+  with test_utils.StandInLlmServer() as server:
+    llm = http_llm.HttpLlm(server.url)
+    results = asyncio.run(
+        _generate_many(llm, ["// This is test alias2.c"] * 5)
+    )
+  assert results == [["[['p0', 'p'], ['p1']]"]] * 5
+  assert len(server.requests) == 5
+  assert len(server.client_addresses) == 1
+  assert server.requests[0]["max_tokens"] == 16
+  assert server.requests[0]["stop"] == ["[eod]"]
+
+
+def test_compressed_requests():
+  with test_utils.StandInLlmServer() as server:
+    llm = http_llm.HttpLlm(server.url, compress_requests=True)
+    results = asyncio.run(_generate_many(llm, ["// This is test alias2.c"]))
+  assert results == [["[['p0', 'p'], ['p1']]"]]
+  assert server.headers[0]["Content-Encoding"] == "gzip"
+
+
+def test_pickling_drops_client():
+  async def generate_and_pickle(llm):
+    await llm.generate("x", 1, 16, ["[eod]"])
+    assert llm._client is not None
+    copied = pickle.loads(pickle.dumps(llm))
+    await llm.aclose()
+    return copied
+
+  with test_utils.StandInLlmServer() as server:
+    llm = http_llm.HttpLlm(server.url)
+    copied = asyncio.run(generate_and_pickle(llm))
+  assert copied._client is None
+  assert copied.url == llm.url
+
+
+@pytest.mark.parametrize(
+    "schema, response, expected",
+    [
+        (
+            http_llm.CompletionsSchema(),
+            {"choices": [{"text": "a"}, {"text": "b"}]},
+            ["a", "b"],
+        ),
+        (
+            http_llm.ChatCompletionsSchema(),
+            {"choices": [{"message": {"content": "a"}}]},
+            ["a"],
+        ),
+        (
+            http_llm.TextGenerationSchema(),
+            [{"generated_text": "a"}],
+            ["a"],
+        ),
+    ],
+)
+def test_schema_parse_response(schema, response, expected):
+  assert schema.parse_response(response) == expected
+
+
+def test_chat_schema_sends_messages():
+  schema = http_llm.ChatCompletionsSchema(model="m")
+  request = schema.build_request("hello", 1, 8, ["[eod]"])
+  assert request["messages"] == [{"role": "user", "content": "hello"}]
+  assert request["model"] == "m"
+  assert "prompt" not in request
+
+
+def test_evaluation_suite_over_http(tmpdir):
+  output_dir = epath.Path(tmpdir)
+  with test_utils.StandInLlmServer() as server:
+    llm = http_llm.HttpLlm(server.url, max_connections=2)
+    suite = evaluation_suite.load_evaluation_suite(
+        test_utils.get_tasks_path(), llm, output_dir
+    )
+    suite.run_suite(None)
+  assert len(server.client_addresses) <= 2
+  # The suite closes the pooled connections when it is done.
+  assert llm._client is None
+  output_text = (output_dir / "eval_summary.md").read_text()
+  assert "* f1: 0.639" in output_text
@@ -17,6 +17,7 @@
 """Evaluation metrics. These are used within Tasks."""
 
 import enum
+import math
 from typing import Any, Iterable, Sequence
 
 
@@ -96,15 +97,52 @@ def cluster_prf1(predicted, actual) -> dict[str, float]:
   return prf1(set(predicted_pairs), set(actual_pairs))
 
 
+def _add_exactly(partials: list[float], value: float) -> None:
+  """Adds a value to a list of non-overlapping partial sums, as `math.fsum`."""
+  i = 0
+  for partial in partials:
+    if abs(value) < abs(partial):
+      value, partial = partial, value
+    high = value + partial
+    low = partial - (high - value)
+    if low:
+      partials[i] = low
+      i += 1
+    value = high
+  partials[i:] = [value]
+
+
+class MacroAverage:
+  """Computes a macroaverage incrementally, one instance at a time.
+
+  The sums are kept exactly, as a few partial sums per metric, so memory does
+  not grow with the number of instances and the result does not depend on the
+  order in which the instances are added.
+  """
+
+  def __init__(self):
+    self._partials: dict[str, list[float]] = {}
+    self._num_instances = 0
+
+  def add(self, result: dict[str, float]) -> None:
+    if not self._num_instances:
+      self._partials = {key: [] for key in result}
+    for key, partials in self._partials.items():
+      _add_exactly(partials, result[key])
+    self._num_instances += 1
+
+  def result(self) -> dict[str, float]:
+    return {
+        key: math.fsum(partials) / self._num_instances
+        for key, partials in self._partials.items()
+    }
+
+
 def macroaverage(
     per_example_results: Sequence[dict[str, float]]
 ) -> dict[str, float]:
   """Compute macroaverage over evaluation results on individual instances."""
-  result = {}
-  num_instances = len(per_example_results)
-  if not num_instances:
-    return result
-  keys = per_example_results[0].keys()
-  for key in keys:
-    result[key] = sum(r[key] for r in per_example_results) / num_instances
-  return result
+  average = MacroAverage()
+  for result in per_example_results:
+    average.add(result)
+  return average.result()
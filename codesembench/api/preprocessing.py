@@ -0,0 +1,187 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Removes text from source code that only costs prompt tokens.
+
+Programs in the benchmark often carry license headers, blank lines and
+trailing whitespace that the model does not need to answer the question. The
+steps here strip them while keeping every other comment, in particular the
+comment with the instructions of the task. Which syntax counts as a comment
+is given per language by the caller.
+"""
+
+import dataclasses
+import enum
+import re
+from typing import Collection
+
+
+class Step(enum.Enum):
+  """Preprocessing steps, applied in the order of this enum."""
+
+  # Copyright and license lines in the leading comments.
+  LICENSE_HEADER = 0
+  TRAILING_WHITESPACE = 1
+  BLANK_LINES = 2
+
+
+@dataclasses.dataclass(frozen=True)
+class CommentSyntax:
+  """The comment syntax of a language.
+
+  Attributes:
+    line: The prefix of a line comment.
+    block: The start and end delimiters of a block comment, if any.
+  """
+
+  line: str
+  block: tuple[str, str] | None = None
+
+
+_LICENSE_PATTERN = re.compile(
+    r'copyright|licen[cs]e|spdx-license-identifier', re.IGNORECASE
+)
+# Stricter than `_LICENSE_PATTERN`, for lines that share a comment with the
+# instructions, which may well ask about licenses.
+_HEADER_LINE_PATTERN = re.compile(
+    r'copyright|spdx-license-identifier|licensed under|all rights reserved',
+    re.IGNORECASE,
+)
+
+
+def _leading_comment_blocks(
+    lines: list[str], syntax: CommentSyntax
+) -> tuple[list[tuple[int, int]], int]:
+  """Finds the comment blocks before the first line of code.
+
+  A block is a run of consecutive line comments, or a single block comment.
+
+  Args:
+    lines: The lines of the source.
+    syntax: The comment syntax of the language.
+
+  Returns:
+    The [start, end) line ranges of the blocks, and the index of the first
+    line of code.
+  """
+  blocks = []
+  i = 0
+  while i < len(lines):
+    stripped = lines[i].strip()
+    if not stripped:
+      i += 1
+    elif stripped.startswith(syntax.line):
+      start = i
+      while i < len(lines) and lines[i].strip().startswith(syntax.line):
+        i += 1
+      blocks.append((start, i))
+    elif syntax.block is not None and stripped.startswith(syntax.block[0]):
+      start = i
+      # The end delimiter may be on the same line as the start delimiter.
+      rest = stripped[len(syntax.block[0]) :]
+      while syntax.block[1] not in rest:
+        i += 1
+        if i == len(lines):
+          # An unterminated comment is left for the model to see.
+          return blocks, start
+        rest = lines[i]
+      if rest.split(syntax.block[1], 1)[1].strip():
+        # Code follows the comment on its last line.
+        return blocks, start
+      i += 1
+      blocks.append((start, i))
+    else:
+      break
+  return blocks, i
+
+
+def strip_license_header(
+    source: str, syntax: CommentSyntax, has_instructions: bool = True
+) -> str:
+  """Removes the license lines from the leading comments of the source.
+
+  In a run of line comments, the lines from the first to the last one that
+  mention a copyright or license are removed, and the lines around them are
+  kept. A block comment that mentions one is removed as a whole.
+
+  If the source has instructions, they are in the comment right before the
+  code, which may mention a license in its own words. A block comment there
+  is kept. From a run of line comments there, only the header lines at the
+  start of the run are removed, up to the first line that is not a copyright
+  or license statement, and never the last line of the run.
+
+  Args:
+    source: The source code.
+    syntax: The comment syntax of the language.
+    has_instructions: Whether the source holds the instructions of a task.
+
+  Returns:
+    The source code without license headers.
+  """
+  lines = source.splitlines(keepends=True)
+  blocks, _ = _leading_comment_blocks(lines, syntax)
+  removed = set()
+  for block_index, (start, end) in enumerate(blocks):
+    is_instructions = has_instructions and block_index == len(blocks) - 1
+    if not lines[start].strip().startswith(syntax.line):
+      if not is_instructions and _LICENSE_PATTERN.search(
+          ''.join(lines[start:end])
+      ):
+        removed.update(range(start, end))
+    elif is_instructions:
+      i = start
+      while i < end - 1 and (
+          _HEADER_LINE_PATTERN.search(lines[i])
+          or (i > start and lines[i].strip() == syntax.line)
+      ):
+        i += 1
+      removed.update(range(start, i))
+    else:
+      matches = [
+          i for i in range(start, end) if _LICENSE_PATTERN.search(lines[i])
+      ]
+      if matches:
+        removed.update(range(matches[0], matches[-1] + 1))
+  if not removed:
+    return source
+  return ''.join(line for i, line in enumerate(lines) if i not in removed)
+
+
+def canonicalize(
+    source: str,
+    syntax: CommentSyntax,
+    steps: Collection[Step],
+    has_instructions: bool = True,
+) -> str:
+  """Applies the given preprocessing steps to source code.
+
+  Args:
+    source: The source code.
+    syntax: The comment syntax of the language.
+    steps: The steps to apply.
+    has_instructions: See `strip_license_header`.
+
+  Returns:
+    The preprocessed source code.
+  """
+  if Step.LICENSE_HEADER in steps:
+    source = strip_license_header(source, syntax, has_instructions)
+  if Step.TRAILING_WHITESPACE in steps:
+    source = re.sub(r'[ \t]+$', '', source, flags=re.MULTILINE)
+  if Step.BLANK_LINES in steps:
+    source = '\n'.join(line for line in source.split('\n') if line.strip())
+    source += '\n' if source else ''
+  return source
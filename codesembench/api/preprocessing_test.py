@@ -0,0 +1,138 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for preprocessing."""
+
+import pytest
+
+from codesembench.api import preprocessing
+
+_C = preprocessing.CommentSyntax("//", ("/*", "*/"))
+_PYTHON = preprocessing.CommentSyntax("#")
+_ALL_STEPS = list(preprocessing.Step)
+
+_C_SOURCE = """/*
+ * Copyright 2024 Example Authors.
+ * Licensed under the Apache License, Version 2.0.
+ */
+
+// Which pointers alias p?   
+
+int f(int *p) {
+
+  int *q = p;  
+  return *q;
+}
+"""
+
+
+def test_canonicalize_c():
+  assert preprocessing.canonicalize(_C_SOURCE, _C, _ALL_STEPS) == (
+      "// Which pointers alias p?\n"
+      "int f(int *p) {\n"
+      "  int *q = p;\n"
+      "  return *q;\n"
+      "}\n"
+  )
+
+
+def test_steps_are_optional():
+  stripped = preprocessing.canonicalize(
+      _C_SOURCE, _C, [preprocessing.Step.LICENSE_HEADER]
+  )
+  assert stripped == _C_SOURCE[_C_SOURCE.index("\n// Which") :]
+  assert preprocessing.canonicalize(_C_SOURCE, _C, []) == _C_SOURCE
+
+
+def test_license_lines_in_line_comments():
+  source = (
+      "#!/usr/bin/python\n"
+      "# SPDX-License-Identifier: MIT\n"
+      "\n"
+      "# What is the type of x?\n"
+      "x = 1\n"
+      "# Copyright notices after code are kept.\n"
+  )
+  assert preprocessing.strip_license_header(source, _PYTHON) == (
+      "#!/usr/bin/python\n"
+      "\n"
+      "# What is the type of x?\n"
+      "x = 1\n"
+      "# Copyright notices after code are kept.\n"
+  )
+
+
+def test_license_merged_with_multi_line_instructions():
+  source = (
+      "// SPDX-License-Identifier: MIT\n"
+      "// Which variables hold a license key?\n"
+      "// Please output the response as a list of names.\n"
+      "int license;\n"
+  )
+  assert preprocessing.strip_license_header(source, _C) == source[
+      source.index("// Which") :
+  ]
+
+
+def test_license_merged_with_instructions():
+  source = (
+      "// Copyright 2024 Foo\n"
+      "// Licensed under MIT.\n"
+      "// Which pointers alias p?\n"
+      "int x;\n"
+  )
+  assert preprocessing.strip_license_header(source, _C) == (
+      "// Which pointers alias p?\nint x;\n"
+  )
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "// In the following program, which variables hold a license key?\n"
+        "int license;\n",
+        "# What is the type of x?\n\n# SPDX-License-Identifier: MIT\nx = 1\n",
+        "/* Which functions check the license? */\nint check_license();\n",
+        "// In the following program, which variables hold a license key?\n"
+        "// Please output the response as a list of names.\n"
+        "\n"
+        "int license;\n",
+    ],
+)
+def test_instructions_before_code_are_kept(source):
+  syntax = _PYTHON if source.startswith("#") else _C
+  assert preprocessing.strip_license_header(source, syntax) == source
+
+
+@pytest.mark.parametrize(
+    "source",
+    [
+        "/* Copyright 2024 */ int x;\n",
+        "/* Copyright 2024\n",
+        "int x;  // Copyright 2024\n",
+    ],
+)
+def test_license_mixed_with_code_is_kept(source):
+  assert preprocessing.strip_license_header(source, _C) == source
+
+
+def test_license_right_before_code_without_instructions():
+  source = "/* Copyright 2024 Foo */\n#include <stdio.h>\n"
+  assert preprocessing.strip_license_header(source, _C) == source
+  assert (
+      preprocessing.strip_license_header(source, _C, has_instructions=False)
+      == "#include <stdio.h>\n"
+  )
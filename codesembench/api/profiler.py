@@ -0,0 +1,202 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per-phase CPU and memory profiling of the evaluation pipeline.
+
+The pipeline marks its phases with `phase(name)`, which does nothing unless a
+`PhaseProfiler` has been activated. Only one CPU profiler can be active at a
+time, so phases nest as a stack: entering a phase pauses the profile of the
+enclosing phase, and leaving it resumes it. This means that time spent in,
+e.g., parsing is attributed only to the parsing phase and not also to the
+dispatch phase around it. Nested phases must therefore not await; only the
+outermost phase may span an `await`.
+"""
+
+import asyncio
+import contextlib
+import contextvars
+import cProfile
+import json
+import statistics
+import time
+import tracemalloc
+from typing import Any, Iterator
+
+from etils import epath
+
+_ACTIVE_PROFILER: contextvars.ContextVar['PhaseProfiler | None'] = (
+    contextvars.ContextVar('active_profiler', default=None)
+)
+
+REPORT_FILENAME = 'profile_report.json'
+
+
+def active() -> 'PhaseProfiler | None':
+  """Returns the profiler activated in the current context, if any."""
+  return _ACTIVE_PROFILER.get()
+
+
+def phase(name: str) -> contextlib.AbstractContextManager[None]:
+  """Attributes the enclosed code to the given phase of the active profiler."""
+  profiler = active()
+  if profiler is None:
+    return contextlib.nullcontext()
+  return profiler.phase(name)
+
+
+class _PhaseStats:
+  """Measurements accumulated over all entries of one phase."""
+
+  def __init__(self):
+    self.profile = cProfile.Profile()
+    self.calls = 0
+    self.wall_time = 0.0
+    self.cpu_time = 0.0
+    self.net_allocated_bytes = 0
+    # Only measured for outermost phases, since the peak is global.
+    self.peak_bytes = None
+    self.top_allocations = []
+
+
+class PhaseProfiler:
+  """Collects CPU profiles and tracemalloc statistics per pipeline phase.
+
+  Attributes:
+    top_n: Number of hotspots and allocation sites to report per phase.
+  """
+
+  def __init__(self, top_n: int = 20):
+    self.top_n = top_n
+    self._phases: dict[str, _PhaseStats] = {}
+    self._stack: list[_PhaseStats] = []
+    self._loop_lags: list[float] = []
+
+  @contextlib.contextmanager
+  def activate(self) -> Iterator['PhaseProfiler']:
+    """Makes this the active profiler, and traces allocations meanwhile."""
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+      tracemalloc.start()
+    token = _ACTIVE_PROFILER.set(self)
+    try:
+      yield self
+    finally:
+      _ACTIVE_PROFILER.reset(token)
+      if started_tracing:
+        tracemalloc.stop()
+
+  @contextlib.contextmanager
+  def phase(self, name: str) -> Iterator[None]:
+    """Attributes the enclosed code to the given phase."""
+    stats = self._phases.setdefault(name, _PhaseStats())
+    outermost = not self._stack
+    if outermost:
+      tracemalloc.reset_peak()
+      snapshot_before = tracemalloc.take_snapshot()
+    else:
+      self._stack[-1].profile.disable()
+    self._stack.append(stats)
+    traced_before = tracemalloc.get_traced_memory()[0]
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    stats.profile.enable()
+    try:
+      yield
+    finally:
+      stats.profile.disable()
+      stats.calls += 1
+      stats.wall_time += time.perf_counter() - wall_start
+      stats.cpu_time += time.process_time() - cpu_start
+      traced_after, peak = tracemalloc.get_traced_memory()
+      stats.net_allocated_bytes += traced_after - traced_before
+      self._stack.pop()
+      if outermost:
+        stats.peak_bytes = max(stats.peak_bytes or 0, peak)
+        differences = tracemalloc.take_snapshot().compare_to(
+            snapshot_before, 'lineno'
+        )
+        stats.top_allocations = [
+            {
+                'location': str(difference.traceback),
+                'size_diff_bytes': difference.size_diff,
+                'count_diff': difference.count_diff,
+            }
+            for difference in differences[: self.top_n]
+        ]
+      else:
+        self._stack[-1].profile.enable()
+
+  async def sample_event_loop_lag(self, interval: float = 0.01) -> None:
+    """Measures how late the event loop wakes up sleepers, until cancelled.
+
+    Args:
+      interval: Seconds between samples.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+      start = loop.time()
+      await asyncio.sleep(interval)
+      self._loop_lags.append(max(0.0, loop.time() - start - interval))
+
+  def _hotspots(self, stats: _PhaseStats) -> list[dict[str, Any]]:
+    stats.profile.create_stats()
+    rows = sorted(
+        stats.profile.stats.items(),  # pytype: disable=attribute-error
+        key=lambda item: item[1][2],
+        reverse=True,
+    )
+    hotspots = []
+    for (filename, line, function), row in rows[: self.top_n]:
+      _, num_calls, total_time, cumulative_time, _ = row
+      hotspots.append({
+          'function': f'{filename}:{line}({function})',
+          'calls': num_calls,
+          'total_time_s': total_time,
+          'cumulative_time_s': cumulative_time,
+      })
+    return hotspots
+
+  def report(self) -> dict[str, Any]:
+    """Returns a JSON-serializable report of all phases."""
+    phases = {}
+    for name, stats in self._phases.items():
+      phases[name] = {
+          'calls': stats.calls,
+          'wall_time_s': stats.wall_time,
+          'cpu_time_s': stats.cpu_time,
+          'hotspots': self._hotspots(stats),
+          'memory': {
+              'net_allocated_bytes': stats.net_allocated_bytes,
+              'peak_bytes': stats.peak_bytes,
+              'top_allocations': stats.top_allocations,
+          },
+      }
+    lags = self._loop_lags
+    event_loop_lag = {'num_samples': len(lags)}
+    if lags:
+      event_loop_lag.update({
+          'mean_s': statistics.fmean(lags),
+          'median_s': statistics.median(lags),
+          'max_s': max(lags),
+      })
+    return {'phases': phases, 'event_loop_lag': event_loop_lag}
+
+  def write_report(self, output_dir: epath.Path) -> None:
+    """Writes the report, and a pstats dump per phase, to `output_dir`."""
+    with open(output_dir / REPORT_FILENAME, 'w') as f:
+      json.dump(self.report(), f, indent=2)
+    for name, stats in self._phases.items():
+      stats.profile.dump_stats(str(output_dir / f'profile_{name}.prof'))
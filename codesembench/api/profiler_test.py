@@ -0,0 +1,72 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for profiler."""
+
+import json
+
+from etils import epath
+
+from codesembench.api import evaluation_suite
+from codesembench.api import profiler
+from codesembench.api import test_utils
+
+
+def test_phase_is_noop_without_active_profiler():
+  assert profiler.active() is None
+  with profiler.phase("anything"):
+    pass
+
+
+def test_nested_phases_are_attributed_separately():
+  phase_profiler = profiler.PhaseProfiler()
+  with phase_profiler.activate():
+    with profiler.phase("outer"):
+      with profiler.phase("inner"):
+        sorted(range(1000), key=str)
+  assert profiler.active() is None
+  report = phase_profiler.report()["phases"]
+  inner_functions = [h["function"] for h in report["inner"]["hotspots"]]
+  outer_functions = [h["function"] for h in report["outer"]["hotspots"]]
+  assert any("sorted" in f for f in inner_functions)
+  assert not any("sorted" in f for f in outer_functions)
+  assert report["outer"]["memory"]["peak_bytes"] is not None
+  assert report["inner"]["memory"]["peak_bytes"] is None
+
+
+def test_profiled_evaluation_suite(tmpdir):
+  output_dir = epath.Path(tmpdir)
+  phase_profiler = profiler.PhaseProfiler(top_n=5)
+  with phase_profiler.activate():
+    suite = evaluation_suite.load_evaluation_suite(
+        test_utils.get_tasks_path(),
+        test_utils.MockLlm(),
+        output_dir,
+    )
+    suite.run_suite(None)
+  phase_profiler.write_report(output_dir)
+
+  report = json.loads((output_dir / profiler.REPORT_FILENAME).read_text())
+  phases = report["phases"]
+  assert set(phases) == {"load_tasks", "dispatch", "parse", "score", "render"}
+  assert phases["parse"]["calls"] == 5
+  # Each program is scored as soon as its completion arrives.
+  assert phases["score"]["calls"] == 5
+  assert len(phases["load_tasks"]["hotspots"]) == 5
+  # The streamed programs are read in the load_tasks phase, one at a time.
+  assert phases["load_tasks"]["calls"] > 1
+  assert "num_samples" in report["event_loop_lag"]
+  assert (output_dir / "profile_dispatch.prof").exists()
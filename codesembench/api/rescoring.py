@@ -0,0 +1,165 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Rescores stored completions against the current tasks, without an LLM.
+
+Every task run writes the raw completions of the LLM to `predictions.jsonl`
+in its log directory. When a metric is added or a gold answer is fixed, those
+completions are parsed and scored again here, so that historical runs can be
+updated without querying the model.
+"""
+
+from concurrent import futures
+import dataclasses
+import json
+from typing import Any, Sequence
+
+from absl import logging
+from etils import epath
+
+from codesembench.api import metrics
+from codesembench.api import task_lib
+from codesembench.api import task_loader
+
+
+@dataclasses.dataclass(frozen=True)
+class RescoredTask:
+  """The result of rescoring one task of one run.
+
+  Attributes:
+    run_dir: The output directory of the run.
+    task_name: The name of the task.
+    results: The new average metrics.
+    num_rescored: Number of programs that were rescored.
+    num_removed: Number of stored completions whose program is no longer part
+      of the task. These are dropped.
+    num_missing: Number of programs of the task without a stored completion.
+      These are not part of the new averages.
+  """
+
+  run_dir: epath.Path
+  task_name: str
+  results: dict[str, Any]
+  num_rescored: int
+  num_removed: int
+  num_missing: int
+
+
+def rescore_task(
+    task: task_lib.PropertyPredictionTask, log_directory: epath.Path
+) -> RescoredTask:
+  """Rescores the stored predictions of one task and rewrites them.
+
+  The predictions file is streamed, so memory does not grow with the length
+  of the completions. The generation statistics of the task are recomputed
+  from the rescored predictions.
+
+  Args:
+    task: The current version of the task.
+    log_directory: The log directory of the task in a previous run.
+
+  Returns:
+    The rescored results.
+  """
+  programs = {program.name: program for program in task.data}
+  predictions_path = log_directory / task_lib.PREDICTIONS_FILENAME
+  rescored_filename = f'{task_lib.PREDICTIONS_FILENAME}.tmp'
+  log = task_lib._PredictionLog(  # pylint: disable=protected-access
+      task, log_directory, rescored_filename
+  )
+  seen = set()
+  num_removed = 0
+  with open(predictions_path, 'r') as f, log:
+    for line in f:
+      record = json.loads(line)
+      program = programs.get(record['name'])
+      if program is None:
+        num_removed += 1
+        continue
+      seen.add(program.name)
+      log.add(
+          program,
+          record['completion'],
+          task.parse_prediction(record['completion']),
+      )
+  (log_directory / rescored_filename).replace(predictions_path)
+  return RescoredTask(
+      run_dir=log_directory.parent,
+      task_name=task.name,
+      results=log.results(),
+      num_rescored=len(seen),
+      num_removed=num_removed,
+      num_missing=len(programs.keys() - seen),
+  )
+
+
+# Tasks loaded by each worker process.
+_WORKER_TASKS: dict[str, task_lib.Task] = {}
+
+
+def _init_worker(tasks_directory: epath.Path) -> None:
+  global _WORKER_TASKS
+  _WORKER_TASKS = {
+      task.name: task for task in task_loader.load_tasks(tasks_directory)
+  }
+
+
+def _rescore_in_worker(run_dir: epath.Path, task_name: str) -> RescoredTask:
+  return rescore_task(_WORKER_TASKS[task_name], run_dir / task_name)
+
+
+def rescore_runs(
+    tasks_directory: epath.Path,
+    run_dirs: Sequence[epath.Path],
+    num_workers: int = 1,
+) -> list[RescoredTask]:
+  """Rescores every task with stored predictions in the given runs.
+
+  Tasks of a run that no longer exist, or that were run before predictions
+  were stored, are skipped.
+
+  Args:
+    tasks_directory: The directory to load the current tasks from.
+    run_dirs: Output directories of previous evaluation runs.
+    num_workers: Number of processes to rescore (run, task) pairs in. Each
+      process loads the tasks once.
+
+  Returns:
+    The rescored results, in the order of `run_dirs` and then task name.
+  """
+  tasks = {task.name: task for task in task_loader.load_tasks(tasks_directory)}
+  jobs = []
+  for run_dir in run_dirs:
+    for task_name in sorted(tasks):
+      if (run_dir / task_name / task_lib.PREDICTIONS_FILENAME).exists():
+        jobs.append((run_dir, task_name))
+      elif (run_dir / task_name).exists():
+        logging.warning(
+            'No stored predictions for %s in %s, skipping.', task_name, run_dir
+        )
+  if not jobs:
+    return []
+  if num_workers <= 1:
+    return [
+        rescore_task(tasks[task_name], run_dir / task_name)
+        for run_dir, task_name in jobs
+    ]
+  with futures.ProcessPoolExecutor(
+      max_workers=num_workers,
+      initializer=_init_worker,
+      initargs=(tasks_directory,),
+  ) as executor:
+    return list(executor.map(_rescore_in_worker, *zip(*jobs)))
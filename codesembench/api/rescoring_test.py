@@ -0,0 +1,129 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for rescoring."""
+
+import json
+import shutil
+
+from etils import epath
+import pytest
+
+from codesembench.api import evaluation_suite
+from codesembench.api import rescoring
+from codesembench.api import test_utils
+
+
+def _run(tasks_dir, output_dir):
+  suite = evaluation_suite.load_evaluation_suite(
+      tasks_dir, test_utils.MockLlm(), output_dir
+  )
+  suite.run_suite(None)
+  return json.loads((output_dir / "eval_summary.json").read_text())
+
+
+@pytest.fixture
+def tasks_dir(tmp_path):
+  tasks_dir = tmp_path / "tasks"
+  shutil.copytree(test_utils.get_tasks_path(), tasks_dir)
+  return epath.Path(tasks_dir)
+
+
+def test_rescoring_unchanged_tasks_reproduces_results(tasks_dir, tmp_path):
+  run_dir = epath.Path(tmp_path / "run")
+  original = _run(tasks_dir, run_dir)
+  rescored = rescoring.rescore_runs(tasks_dir, [run_dir])
+  assert [r.task_name for r in rescored] == [
+      "simple_c_alias",
+      "simple_c_escape",
+  ]
+  for result in rescored:
+    assert result.results == original[result.task_name]
+    assert result.num_removed == 0
+    assert result.num_missing == 0
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_rescoring_picks_up_fixed_gold_answers(
+    tasks_dir, tmp_path, num_workers
+):
+  run_dirs = [epath.Path(tmp_path / "run1"), epath.Path(tmp_path / "run2")]
+  for run_dir in run_dirs:
+    original = _run(tasks_dir, run_dir)
+  assert original["simple_c_alias"]["recall"] < 1.0
+
+  # Make the canned answer for alias2.c correct.
+  (tasks_dir / "simple_c_alias" / "answers" / "alias2.c").write_text(
+      '[["p0", "p"], ["p1"]]'
+  )
+  summaries = evaluation_suite.rescore_runs(tasks_dir, run_dirs, num_workers)
+  for run_dir in run_dirs:
+    summary = json.loads((run_dir / "eval_summary.json").read_text())
+    assert summary == summaries[run_dir]
+    assert summary["simple_c_alias"]["recall"] > original["simple_c_alias"][
+        "recall"
+    ]
+    assert summary["simple_c_escape"] == original["simple_c_escape"]
+    assert "## simple_c_alias" in (run_dir / "eval_summary.md").read_text()
+
+
+def test_rescoring_skips_removed_programs(tasks_dir, tmp_path):
+  run_dir = epath.Path(tmp_path / "run")
+  _run(tasks_dir, run_dir)
+  (tasks_dir / "simple_c_alias" / "alias3.c").unlink()
+  (tasks_dir / "simple_c_alias" / "answers" / "alias3.c").unlink()
+  rescored = rescoring.rescore_runs(tasks_dir, [run_dir])
+  assert rescored[0].num_rescored == 2
+  assert rescored[0].num_removed == 1
+  lines = (run_dir / "simple_c_alias" / "predictions.jsonl").read_text()
+  assert len(lines.splitlines()) == 2
+
+
+def test_rescoring_updates_generation_stats(tasks_dir, tmp_path):
+  run_dir = epath.Path(tmp_path / "run")
+  _run(tasks_dir, run_dir)
+  task_dir = run_dir / "simple_c_alias"
+  stats = json.loads((task_dir / "generation_stats.json").read_text())
+  predictions_path = task_dir / "predictions.jsonl"
+  records = [json.loads(line) for line in predictions_path.open()]
+  records[0]["completion"] = "not a list"
+  predictions_path.write_text(
+      "".join(json.dumps(record) + "\n" for record in records)
+  )
+  rescoring.rescore_runs(tasks_dir, [run_dir])
+  rescored_stats = json.loads((task_dir / "generation_stats.json").read_text())
+  assert rescored_stats["num_parse_failures"] == (
+      stats["num_parse_failures"] + 1
+  )
+  assert rescored_stats["num_requests"] == stats["num_requests"]
+
+
+def test_rescore_report_counts_changed_programs(tasks_dir, tmp_path):
+  run_dir = epath.Path(tmp_path / "run")
+  _run(tasks_dir, run_dir)
+  alias_dir = tasks_dir / "simple_c_alias"
+  (alias_dir / "alias3.c").unlink()
+  (alias_dir / "answers" / "alias3.c").unlink()
+  (alias_dir / "alias4.c").write_text("int x;\n")
+  (alias_dir / "answers" / "alias4.c").write_text("[]")
+  evaluation_suite.rescore_runs(tasks_dir, [run_dir])
+  report = json.loads((run_dir / "rescore_report.json").read_text())
+  assert report["simple_c_alias"] == {
+      "num_rescored": 2,
+      "num_removed": 1,
+      "num_missing": 1,
+  }
+  assert report["simple_c_escape"]["num_missing"] == 0
@@ -0,0 +1,250 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Orders LLM requests by estimated cost to minimize the makespan.
+
+Programs are otherwise dispatched in the order in which they were globbed from
+disk, so a long prompt that happens to come last can dominate the wall-clock
+time of a run. `ScheduledLlm` holds back requests beyond a concurrency limit
+and always starts the most expensive pending request first, i.e., it is a
+longest-processing-time-first (LPT) list scheduler.
+"""
+
+import asyncio
+import dataclasses
+import heapq
+import itertools
+import time
+from typing import Any, Sequence
+
+from codesembench.api import task_lib
+
+# Approximate number of characters per token of source code, for estimates
+# from sizes alone.
+_CHARS_PER_TOKEN = 4
+
+
+@dataclasses.dataclass(frozen=True)
+class CostModel:
+  """Estimates the relative cost of a request from its size.
+
+  Attributes:
+    prompt_token_cost: Cost of processing one prompt token.
+    output_token_cost: Cost of generating one output token. Decoding is
+      sequential, so this is typically much larger than the prompt cost.
+  """
+
+  prompt_token_cost: float = 1.0
+  output_token_cost: float = 10.0
+
+  def estimate(self, prompt: str, num_samples: int, max_length: int) -> float:
+    """Returns the estimated cost of a generate call.
+
+    Args:
+      prompt: The prompt.
+      num_samples: The number of samples requested.
+      max_length: The generation budget, used as the expected answer size.
+
+    Returns:
+      The cost, in arbitrary units.
+    """
+    return (
+        self.prompt_token_cost * task_lib.estimate_num_tokens(prompt)
+        + self.output_token_cost * max_length * num_samples
+    )
+
+  def estimate_from_size(
+      self, prompt_size: int, num_samples: int, max_length: int
+  ) -> float:
+    """Returns the estimated cost of a generate call from the prompt size.
+
+    This avoids reading the prompt when only its size is known, e.g., from the
+    manifest of a task.
+
+    Args:
+      prompt_size: The size of the prompt in characters.
+      num_samples: The number of samples requested.
+      max_length: The generation budget, used as the expected answer size.
+
+    Returns:
+      The cost, in the units of `estimate`.
+    """
+    return (
+        self.prompt_token_cost * prompt_size / _CHARS_PER_TOKEN
+        + self.output_token_cost * max_length * num_samples
+    )
+
+
+@dataclasses.dataclass(frozen=True)
+class RequestRecord:
+  """Timing of a single request that went through the scheduler."""
+
+  cost: float
+  submit_time: float
+  start_time: float
+  end_time: float
+
+
+def simulate_makespan(costs: Sequence[float], max_concurrency: int) -> float:
+  """Returns the makespan of list-scheduling the costs in the given order.
+
+  Each request is started on the first slot to become free.
+
+  Args:
+    costs: The request costs, in the order in which they are started.
+    max_concurrency: The number of requests that may run at once.
+
+  Returns:
+    The time at which the last request finishes, in the units of the costs.
+  """
+  slots = [0.0] * min(max_concurrency, len(costs))
+  for cost in costs:
+    heapq.heapreplace(slots, slots[0] + cost)
+  return max(slots, default=0.0)
+
+
+class ScheduledLlm(task_lib.LlmInterface):
+  """Wraps an LLM so that at most `max_concurrency` requests run at once.
+
+  Waiting requests are started in descending order of estimated cost. When a
+  burst of requests arrives while the scheduler is idle, it waits until the
+  event loop has no more requests to submit before starting any of them, so
+  the whole burst is ordered rather than just the requests after the first
+  `max_concurrency`.
+  """
+
+  def __init__(
+      self,
+      llm: task_lib.LlmInterface,
+      max_concurrency: int,
+      cost_model: CostModel | None = None,
+  ):
+    if max_concurrency < 1:
+      raise ValueError(
+          f'max_concurrency must be positive, got {max_concurrency}.'
+      )
+    self._llm = llm
+    self._max_concurrency = max_concurrency
+    self._cost_model = cost_model or CostModel()
+    self._pending = []
+    self._counter = itertools.count()
+    self._in_flight = 0
+    self._settling = False
+    self._settle_task = None
+    self.records: list[RequestRecord] = []
+
+  async def generate(
+      self,
+      prompt: str,
+      num_samples: int,
+      max_length: int,
+      stop_tokens: Sequence[str],
+  ) -> Sequence[str]:
+    cost = self._cost_model.estimate(prompt, num_samples, max_length)
+    submit_time = time.perf_counter()
+    slot = asyncio.get_running_loop().create_future()
+    heapq.heappush(self._pending, (-cost, next(self._counter), slot))
+    if self._in_flight == 0 and not self._settling:
+      self._settling = True
+      self._settle_task = asyncio.create_task(self._settle())
+    else:
+      self._dispatch()
+    try:
+      await slot
+    except asyncio.CancelledError:
+      if slot.done() and not slot.cancelled():
+        self._release()
+      raise
+    start_time = time.perf_counter()
+    try:
+      return await self._llm.generate(
+          prompt, num_samples, max_length, stop_tokens
+      )
+    finally:
+      self.records.append(
+          RequestRecord(
+              cost=cost,
+              submit_time=submit_time,
+              start_time=start_time,
+              end_time=time.perf_counter(),
+          )
+      )
+      self._release()
+
+  async def _settle(self):
+    """Waits until no more requests are being submitted, then dispatches."""
+    num_pending = -1
+    while num_pending != len(self._pending):
+      num_pending = len(self._pending)
+      await asyncio.sleep(0)
+    self._settling = False
+    self._dispatch()
+
+  def _dispatch(self):
+    while (
+        not self._settling
+        and self._pending
+        and self._in_flight < self._max_concurrency
+    ):
+      _, _, slot = heapq.heappop(self._pending)
+      if slot.cancelled():
+        continue
+      self._in_flight += 1
+      slot.set_result(None)
+
+  def _release(self):
+    self._in_flight -= 1
+    self._dispatch()
+
+  def makespan_report(self) -> dict[str, Any]:
+    """Returns predicted and actual makespans of the requests so far.
+
+    The cost model only predicts relative costs, so they are converted into
+    seconds with a single rate fitted to the measured request durations. The
+    predicted makespan is then that of LPT scheduling the requests under the
+    concurrency limit; the prediction for starting them in submission order
+    is included for comparison.
+
+    Returns:
+      A JSON-serializable dictionary.
+    """
+    records = self.records
+    report = {
+        'policy': 'longest_processing_time_first',
+        'max_concurrency': self._max_concurrency,
+        'num_requests': len(records),
+    }
+    if not records:
+      return report
+    total_cost = sum(r.cost for r in records)
+    total_duration = sum(r.end_time - r.start_time for r in records)
+    seconds_per_cost = total_duration / total_cost if total_cost else 0.0
+    by_submission = sorted(records, key=lambda r: r.submit_time)
+    costs = [r.cost * seconds_per_cost for r in by_submission]
+    report.update({
+        'seconds_per_cost_unit': seconds_per_cost,
+        'predicted_makespan_s': simulate_makespan(
+            sorted(costs, reverse=True), self._max_concurrency
+        ),
+        'predicted_submission_order_makespan_s': simulate_makespan(
+            costs, self._max_concurrency
+        ),
+        'actual_makespan_s': (
+            max(r.end_time for r in records)
+            - min(r.submit_time for r in records)
+        ),
+    })
+    return report
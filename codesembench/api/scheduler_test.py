@@ -0,0 +1,126 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for scheduler."""
+
+import asyncio
+import json
+from typing import Sequence
+
+from etils import epath
+import pytest
+
+from codesembench.api import evaluation_suite
+from codesembench.api import scheduler
+from codesembench.api import task_lib
+from codesembench.api import task_loader
+from codesembench.api import test_utils
+
+
+class _RecordingLlm(task_lib.LlmInterface):
+  """Records the order in which prompts are started."""
+
+  def __init__(self):
+    self.started = []
+    self.in_flight = 0
+    self.max_in_flight = 0
+
+  async def generate(
+      self,
+      prompt: str,
+      num_samples: int,
+      max_length: int,
+      stop_tokens: Sequence[str],
+  ) -> Sequence[str]:
+    del num_samples, max_length, stop_tokens
+    self.started.append(prompt)
+    self.in_flight += 1
+    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    await asyncio.sleep(0.001)
+    self.in_flight -= 1
+    return [prompt]
+
+
+async def _generate_all(llm, prompts):
+  return await asyncio.gather(
+      *[llm.generate(p, 1, 16, ["[eod]"]) for p in prompts]
+  )
+
+
+def test_longest_requests_start_first():
+  inner = _RecordingLlm()
+  llm = scheduler.ScheduledLlm(inner, max_concurrency=2)
+  prompts = ["a " * n for n in (1, 5, 3, 10, 2)]
+  results = asyncio.run(_generate_all(llm, prompts))
+  assert [r[0] for r in results] == prompts
+  assert inner.started == sorted(prompts, key=len, reverse=True)
+  assert inner.max_in_flight == 2
+
+
+def test_makespan_report():
+  llm = scheduler.ScheduledLlm(_RecordingLlm(), max_concurrency=3)
+  asyncio.run(_generate_all(llm, ["x " * n for n in range(10)]))
+  report = llm.makespan_report()
+  assert report["num_requests"] == 10
+  assert report["max_concurrency"] == 3
+  assert report["actual_makespan_s"] > 0.0
+  assert (
+      report["predicted_makespan_s"]
+      <= report["predicted_submission_order_makespan_s"]
+  )
+
+
+@pytest.mark.parametrize(
+    "costs, max_concurrency, expected",
+    [
+        ([], 2, 0.0),
+        ([3.0, 2.0, 2.0], 1, 7.0),
+        ([3.0, 2.0, 2.0], 2, 4.0),
+        ([1.0, 1.0, 4.0], 2, 5.0),
+    ],
+)
+def test_simulate_makespan(costs, max_concurrency, expected):
+  assert scheduler.simulate_makespan(costs, max_concurrency) == expected
+
+
+def test_evaluation_suite_writes_scheduling_report(tmpdir):
+  output_dir = epath.Path(tmpdir)
+  suite = evaluation_suite.load_evaluation_suite(
+      test_utils.get_tasks_path(),
+      test_utils.MockLlm(),
+      output_dir,
+      max_concurrency=2,
+  )
+  suite.run_suite(None)
+  assert "* f1: 0.639" in (output_dir / "eval_summary.md").read_text()
+  report = json.loads((output_dir / "scheduling_report.json").read_text())
+  assert report["num_requests"] == 5
+
+
+def test_evaluation_suite_schedules_streamed_tasks(tmpdir):
+  task = task_loader.load_tasks(
+      test_utils.get_tasks_path(), stream_programs=True
+  )[0]
+  inner = _RecordingLlm()
+  suite = evaluation_suite.EvaluationSuite(
+      inner, [task], epath.Path(tmpdir), max_concurrency=1, queue_size=1
+  )
+  suite.run_suite(None)
+  # All programs reach the scheduler before the first request starts.
+  assert len(inner.started) == len(task.data) > 1
+  assert inner.started == sorted(
+      inner.started, key=task_lib.estimate_num_tokens, reverse=True
+  )
@@ -0,0 +1,274 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Splits the LLM queries of an evaluation across worker processes.
+
+At high concurrency, a single event loop saturates one core on request
+serialization, response parsing and bookkeeping. Here the programs of all
+tasks are partitioned into shards of roughly equal estimated cost, and each
+shard is queried in its own process, with its own (optionally uvloop) event
+loop and its share of the concurrency budget. The predictions are sent back to
+the parent, which scores them and writes the reports.
+"""
+
+import asyncio
+from concurrent import futures
+import copy
+import dataclasses
+import heapq
+import multiprocessing
+from typing import Any, Coroutine, Sequence
+
+from codesembench.api import scheduler
+from codesembench.api import task_lib
+
+
+def _import_uvloop():
+  try:
+    import uvloop  # pylint: disable=g-import-not-at-top
+  except ImportError as e:
+    raise ImportError(
+        'uvloop is not installed. Install it with `pip install uvloop`.'
+    ) from e
+  return uvloop
+
+
+def new_event_loop(use_uvloop: bool) -> asyncio.AbstractEventLoop:
+  """Returns a new event loop, optionally a uvloop one."""
+  if use_uvloop:
+    return _import_uvloop().new_event_loop()
+  return asyncio.new_event_loop()
+
+
+def run_event_loop(coroutine: Coroutine[Any, Any, Any], use_uvloop: bool):
+  """Runs the coroutine in a new event loop, optionally a uvloop one.
+
+  Args:
+    coroutine: The coroutine to run.
+    use_uvloop: Whether to use uvloop. This requires the `uvloop` package.
+
+  Returns:
+    The result of the coroutine.
+  """
+  if not use_uvloop:
+    return asyncio.run(coroutine)
+  try:
+    uvloop = _import_uvloop()
+  except ImportError:
+    coroutine.close()
+    raise
+  return uvloop.run(coroutine)
+
+
+def _source_size(program: task_lib.Program) -> int:
+  """Returns the size of the sources of a program, without reading them."""
+  if isinstance(program, task_lib.MultiFileProgram):
+    return sum(entry.size for entry in program.files)
+  return len(program.source_code)
+
+
+def partition(
+    tasks: Sequence[task_lib.PropertyPredictionTask],
+    num_shards: int,
+    cost_model: scheduler.CostModel | None = None,
+) -> list[dict[str, list[int]]]:
+  """Partitions the programs of the tasks into shards of similar total cost.
+
+  Programs are assigned longest first, each to the currently cheapest shard.
+  The cost of a program is estimated from the size of its sources, so that the
+  sources of per-directory programs are not read in the parent process.
+
+  Args:
+    tasks: The tasks to partition.
+    num_shards: The number of shards.
+    cost_model: Estimates the cost of querying a program.
+
+  Returns:
+    For each non-empty shard, a mapping from task name to the sorted indices
+    of its programs in the shard.
+  """
+  cost_model = cost_model or scheduler.CostModel()
+  items = []
+  for task in tasks:
+    max_length = task.max_length or task_lib.DEFAULT_MAX_LENGTH
+    for i, program in enumerate(task.data):
+      cost = cost_model.estimate_from_size(
+          _source_size(program), 1, max_length
+      )
+      items.append((cost, task.name, i))
+  items.sort(key=lambda item: item[0], reverse=True)
+  loads = [(0.0, shard) for shard in range(num_shards)]
+  shards = [{} for _ in range(num_shards)]
+  for cost, task_name, i in items:
+    load, shard = heapq.heappop(loads)
+    shards[shard].setdefault(task_name, []).append(i)
+    heapq.heappush(loads, (load + cost, shard))
+  for shard in shards:
+    for indices in shard.values():
+      indices.sort()
+  return [shard for shard in shards if shard]
+
+
+def _shard_task(
+    task: task_lib.PropertyPredictionTask, indices: Sequence[int]
+) -> task_lib.PropertyPredictionTask:
+  """Returns a copy of the task with only the given programs."""
+  shard_task = copy.copy(task)
+  shard_task.data = [task.data[i] for i in indices]
+  shard_task.few_shot_examples = {
+      program.name: task.few_shot_examples[program.name]
+      for program in shard_task.data
+      if program.name in task.few_shot_examples
+  }
+  return shard_task
+
+
+@dataclasses.dataclass(frozen=True)
+class ShardResult:
+  """What a worker sends back to the parent.
+
+  Attributes:
+    predictions: For each task, the (completion, prediction) of each program
+      of the shard, in the order of the shard.
+    scheduling_report: The makespan report of the worker, if its requests were
+      scheduled.
+  """
+
+  predictions: dict[str, list[tuple[str, Any]]]
+  scheduling_report: dict[str, Any] | None
+
+
+def _predict_shard(
+    llm: task_lib.LlmInterface,
+    shard_tasks: Sequence[task_lib.PropertyPredictionTask],
+    max_concurrency: int | None,
+    use_uvloop: bool,
+) -> ShardResult:
+  """Queries the LLM for one shard. Runs in a worker process."""
+
+  async def predict_all() -> ShardResult:
+    shard_llm = llm
+    if max_concurrency is not None:
+      shard_llm = scheduler.ScheduledLlm(llm, max_concurrency)
+    results = await asyncio.gather(
+        *[task.predict(shard_llm, task.data) for task in shard_tasks]
+    )
+    aclose = getattr(llm, 'aclose', None)
+    if aclose is not None:
+      await aclose()
+    return ShardResult(
+        predictions={
+            task.name: [
+                (completion, prediction)
+                for _, completion, prediction in task_predictions
+            ]
+            for task, task_predictions in zip(shard_tasks, results)
+        },
+        scheduling_report=(
+            shard_llm.makespan_report()
+            if isinstance(shard_llm, scheduler.ScheduledLlm)
+            else None
+        ),
+    )
+
+  return run_event_loop(predict_all(), use_uvloop)
+
+
+def split_budget(budget: int, num_parts: int) -> list[int]:
+  """Splits a budget into parts that differ by at most one and sum to it."""
+  return [
+      budget // num_parts + (i < budget % num_parts) for i in range(num_parts)
+  ]
+
+
+async def predict_in_workers(
+    llm: task_lib.LlmInterface,
+    tasks: Sequence[task_lib.PropertyPredictionTask],
+    num_workers: int,
+    max_concurrency: int | None = None,
+    use_uvloop: bool = False,
+) -> tuple[
+    dict[str, list[tuple[task_lib.Program, str, Any]]],
+    list[dict[str, Any]],
+]:
+  """Queries the LLM for all programs of the tasks in worker processes.
+
+  Args:
+    llm: The LLM to be queried. It is pickled and sent to every worker.
+    tasks: The tasks to query the LLM for.
+    num_workers: The number of worker processes.
+    max_concurrency: If set, the total number of concurrent requests, which is
+      split as evenly as possible between the workers. At most this many
+      workers are started.
+    use_uvloop: Whether the workers run uvloop event loops.
+
+  Returns:
+    For each task, the predictions in the format of
+    `PropertyPredictionTask.predict`, in the order of the task's programs; and
+    the scheduling reports of the workers.
+
+  Raises:
+    ValueError: If `max_concurrency` is not positive.
+  """
+  if max_concurrency is not None:
+    if max_concurrency < 1:
+      raise ValueError(
+          f'max_concurrency must be positive, got {max_concurrency}.'
+      )
+    num_workers = min(num_workers, max_concurrency)
+  shards = partition(tasks, num_workers)
+  if not shards:
+    return {task.name: [] for task in tasks}, []
+  if max_concurrency is None:
+    shard_concurrency = [None] * len(shards)
+  else:
+    shard_concurrency = split_budget(max_concurrency, len(shards))
+  tasks_by_name = {task.name: task for task in tasks}
+  loop = asyncio.get_running_loop()
+  # Forking a process with running threads, e.g., in the daemon, is unsafe.
+  with futures.ProcessPoolExecutor(
+      max_workers=len(shards),
+      mp_context=multiprocessing.get_context('spawn'),
+  ) as executor:
+    shard_results = await asyncio.gather(*[
+        loop.run_in_executor(
+            executor,
+            _predict_shard,
+            llm,
+            [
+                _shard_task(tasks_by_name[task_name], indices)
+                for task_name, indices in shard.items()
+            ],
+            concurrency,
+            use_uvloop,
+        )
+        for shard, concurrency in zip(shards, shard_concurrency)
+    ])
+
+  predictions = {task.name: [None] * len(task.data) for task in tasks}
+  for shard, shard_result in zip(shards, shard_results):
+    for task_name, indices in shard.items():
+      task = tasks_by_name[task_name]
+      for i, (completion, prediction) in zip(
+          indices, shard_result.predictions[task_name]
+      ):
+        predictions[task_name][i] = (task.data[i], completion, prediction)
+  reports = [
+      shard_result.scheduling_report
+      for shard_result in shard_results
+      if shard_result.scheduling_report is not None
+  ]
+  return predictions, reports
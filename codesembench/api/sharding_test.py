@@ -0,0 +1,149 @@
+#!/usr/bin/python
+#
+# Copyright 2024 DeepMind Technologies Limited
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for sharding."""
+
+import asyncio
+import copy
+import json
+
+from etils import epath
+import pytest
+
+from codesembench.api import evaluation_suite
+from codesembench.api import sharding
+from codesembench.api import task_lib
+from codesembench.api import task_loader
+from codesembench.api import test_utils
+
+
+def test_partition_covers_every_program_once():
+  tasks = task_loader.load_tasks(test_utils.get_tasks_path())
+  shards = sharding.partition(tasks, 2)
+  assert len(shards) == 2
+  for task in tasks:
+    indices = sorted(i for shard in shards for i in shard.get(task.name, []))
+    assert indices == list(range(len(task.data)))
+
+
+def test_partition_drops_empty_shards():
+  tasks = task_loader.load_tasks(test_utils.get_tasks_path())
+  num_programs = sum(len(task.data) for task in tasks)
+  assert len(sharding.partition(tasks, num_programs + 3)) == num_programs
+
+
+def test_partition_estimates_multi_file_costs_from_manifest(tmp_path):
+  task = copy.copy(task_loader.load_tasks(test_utils.get_tasks_path())[0])
+
+  def program(name, size):
+    # The files do not exist, so reading them would fail.
+    return task_lib.MultiFileProgram(
+        name=name,
+        gold_answer=[],
+        output_type=task.data[0].output_type,
+        path=epath.Path(tmp_path / name),
+        build_command="",
+        language=task_lib.Language.C,
+        files=(task_lib.ManifestEntry("main.c", size, 0.0, ""),),
+        digest=name,
+    )
+
+  task.data = [
+      program("large", 100_000),
+      program("small1", 10),
+      program("small2", 10),
+  ]
+  shards = sharding.partition([task], 2)
+  assert sorted(shard[task.name] for shard in shards) == [[0], [1, 2]]
+
+
+@pytest.mark.parametrize(
+    "budget, num_parts, expected",
+    [(8, 3, [3, 3, 2]), (3, 3, [1, 1, 1]), (2, 4, [1, 1, 0, 0])],
+)
+def test_split_budget(budget, num_parts, expected):
+  assert sharding.split_budget(budget, num_parts) == expected
+
+
+def test_workers_reproduce_single_process_results(tmp_path):
+  outputs = {}
+  for num_workers in (1, 2):
+    output_dir = epath.Path(tmp_path / f"workers{num_workers}")
+    suite = evaluation_suite.load_evaluation_suite(
+        test_utils.get_tasks_path(),
+        test_utils.MockLlm(),
+        output_dir,
+        max_concurrency=4,
+        num_workers=num_workers,
+    )
+    suite.run_suite(None)
+    outputs[num_workers] = output_dir
+
+  for filename in (
+      "eval_summary.md",
+      "eval_summary.json",
+      "simple_c_alias/predictions.jsonl",
+      "simple_c_escape/predictions.jsonl",
+  ):
+    assert (outputs[2] / filename).read_text() == (
+        outputs[1] / filename
+    ).read_text()
+  report = json.loads((outputs[2] / "scheduling_report.json").read_text())
+  assert len(report["workers"]) == 2
+
+
+def test_workers_share_concurrency_budget(tmp_path):
+  output_dir = epath.Path(tmp_path)
+  suite = evaluation_suite.load_evaluation_suite(
+      test_utils.get_tasks_path(),
+      test_utils.MockLlm(),
+      output_dir,
+      max_concurrency=1,
+      num_workers=2,
+  )
+  suite.run_suite(None)
+  report = json.loads((output_dir / "scheduling_report.json").read_text())
+  assert len(report["workers"]) == 1
+  assert report["workers"][0]["max_concurrency"] == 1
+
+
+def test_predict_in_workers_without_programs():
+  task = copy.copy(task_loader.load_tasks(test_utils.get_tasks_path())[0])
+  task.data = []
+  predictions, reports = asyncio.run(
+      sharding.predict_in_workers(test_utils.MockLlm(), [task], 2, 4)
+  )
+  assert predictions == {task.name: []}
+  assert reports == []
+
+
+def test_predict_in_workers_rejects_empty_budget():
+  tasks = task_loader.load_tasks(test_utils.get_tasks_path())
+  with pytest.raises(ValueError, match="max_concurrency"):
+    asyncio.run(
+        sharding.predict_in_workers(test_utils.MockLlm(), tasks, 2, 0)
+    )
+
+
+def test_run_event_loop_with_uvloop():
+  pytest.importorskip("uvloop")
+
+  async def loop_type():
+    return type(asyncio.get_running_loop()).__module__
+
+  assert sharding.run_event_loop(loop_type(), use_uvloop=True).startswith(
+      "uvloop"
+  )
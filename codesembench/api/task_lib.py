@@ -18,24 +18,43 @@
 
 import abc
 import asyncio
+import collections
 import dataclasses
 import enum
+import hashlib
 import json
+import math
 import re
 import typing
-from typing import Any, List, Sequence, Set
+from typing import Any, Callable, Iterable, Iterator, List, Sequence, Set
 
 from etils import epath
 import rich
 import rich.progress
 
 from codesembench.api import metrics
+from codesembench.api import preprocessing
+from codesembench.api import profiler
 
 
 DEFAULT_NUM_SAMPLES = 1
 DEFAULT_MAX_LENGTH = 1024
+# Per-task generation budgets are this multiple of the longest gold answer.
+DEFAULT_MAX_LENGTH_MARGIN = 2.0
+MIN_MAX_LENGTH = 16
 DEFAULT_STOP_TOKENS = ['[eod]']
 
+# Capacity of each queue between the load, generate and score stages of a
+# task run. This also bounds the number of requests in flight per task.
+DEFAULT_QUEUE_SIZE = 128
+
+# Per-program results of a task, written to its log directory.
+PREDICTIONS_FILENAME = 'predictions.jsonl'
+
+# Rough approximation of a tokenizer: identifiers, numbers and individual
+# punctuation characters each count as one token.
+_TOKEN_PATTERN = re.compile(r'\w+|[^\w\s]')
+
 
 class TaskType(enum.Enum):
   """Valid types of tasks."""
@@ -97,6 +116,7 @@ class Task(abc.ABC):
       llm: LlmInterface,
       log_directory: epath.Path,
       progress: rich.progress.Progress,
+      queue_size: int = DEFAULT_QUEUE_SIZE,
   ) -> dict[str, Any]:
     """Runs the evaluation task.
 
@@ -105,6 +125,7 @@ class Task(abc.ABC):
       log_directory: A directory, fully owned by the evaluation, to write any
         outputs.
       progress: A Rich progress bar to display progress.
+      queue_size: The capacity of the queues between the stages of the run.
 
     Returns:
       A dictionary with the evaluation metrics results of the evaluation.
@@ -132,43 +153,392 @@ class PropertyPredictionTask(Task):
   file_pattern: str
   answer_path: str = 'answers'
   metric: metrics.EvaluationMetrics = metrics.EvaluationMetrics.PRF1
-  data: List['SingleFileProgram'] = dataclasses.field(default_factory=list)
+  # Generation budget in tokens. If not given in the metadata, this is set
+  # from the gold answers by `fit_max_length` when the task is loaded.
+  max_length: int | None = None
+  max_length_margin: float = DEFAULT_MAX_LENGTH_MARGIN
+  stop_tokens: List[str] = dataclasses.field(
+      default_factory=lambda: list(DEFAULT_STOP_TOKENS)
+  )
+  build_command: str = ''
+  # Number of similar programs of the task, with their gold answers, to
+  # prepend to each prompt. The examples are selected by `few_shot` when the
+  # task is loaded.
+  num_shots: int = 0
+  # Steps to strip noise, such as license headers, from the programs before
+  # they are sent to the model.
+  preprocess_steps: List[preprocessing.Step] = dataclasses.field(
+      default_factory=list
+  )
+  data: List['Program'] = dataclasses.field(default_factory=list)
+  # If set, `data` is not loaded up front. Instead, `run` reads the programs
+  # one at a time from the returned iterator while it queries the LLM.
+  program_source: Callable[[], Iterator['Program']] | None = dataclasses.field(
+      init=False, default=None, repr=False
+  )
+  few_shot_examples: dict[str, List['Program']] = dataclasses.field(
+      init=False, default_factory=dict, repr=False
+  )
+  # The preprocessed sources of the programs, keyed by content hash.
+  _prompt_sources: dict[str, 'PromptSource'] = dataclasses.field(
+      init=False, default_factory=dict, repr=False
+  )
   metric_fn: Any = dataclasses.field(init=False)
 
   def __post_init__(self):
     self.metric_fn = self.metric.metric_fn()
 
+  def fit_max_length(self, gold_answers: Iterable[Any] | None = None) -> int:
+    """Sets `max_length` from the sizes of the gold answers.
+
+    The budget is the size of the longest gold answer times
+    `max_length_margin`, but at least `MIN_MAX_LENGTH` and at most
+    `DEFAULT_MAX_LENGTH` tokens.
+
+    Args:
+      gold_answers: The gold answers of all programs of the task. Defaults to
+        the answers of the programs in `data`.
+
+    Returns:
+      The new value of `max_length`.
+    """
+    if gold_answers is None:
+      gold_answers = (program.gold_answer for program in self.data)
+    longest_answer = max(
+        (estimate_num_tokens(json.dumps(answer)) for answer in gold_answers),
+        default=0,
+    )
+    self.max_length = min(
+        DEFAULT_MAX_LENGTH,
+        max(MIN_MAX_LENGTH, math.ceil(longest_answer * self.max_length_margin)),
+    )
+    return self.max_length
+
   async def run(
       self,
       llm: LlmInterface,
       log_directory: epath.Path,
       progress: rich.progress.Progress,
+      queue_size: int = DEFAULT_QUEUE_SIZE,
   ) -> dict[str, Any]:
     """Runs the evaluation task.
 
+    The run is a pipeline of three concurrent stages connected by bounded
+    queues: programs are read from `program_source` (or `data`), each program
+    is sent to the LLM as soon as it has been read, and each completion is
+    parsed and scored as soon as it arrives. A program is only read once fewer
+    than `queue_size` programs have been read but not yet logged, so at most
+    that many programs and their predictions are held in memory at a time,
+    even if one request is much slower than the others.
+
+    Besides returning the metrics, this writes the completion, prediction and
+    metrics of every program to `predictions.jsonl` in the log directory, in
+    the order in which the programs were read, so that the run can be rescored
+    later, and statistics about the length of the generations to
+    `generation_stats.json`. Predictions that complete before those of earlier
+    programs are held back until they can be written in order.
+
     Args:
       llm: The LLM to be queried.
       log_directory: A directory, fully owned by the evaluation, to write any
         outputs.
       progress: A Rich progress bar to display progress.
+      queue_size: The capacity of the queues between the stages. This is also
+        the number of concurrent requests of the task.
 
     Returns:
       A dictionary with the results of the evaluation.
     """
+    program_queue = asyncio.Queue(maxsize=queue_size)
+    prediction_queue = asyncio.Queue(maxsize=queue_size)
+    # Released when a program has been logged.
+    window = asyncio.Semaphore(queue_size)
+    progress_task = progress.add_task(self.name, total=len(self.data) or None)
+
+    async def read(programs: Iterator['Program']) -> 'Program | None':
+      if profiler.active() is None:
+        # Reading a program blocks on the filesystem.
+        return await asyncio.to_thread(next, programs, None)
+      # cProfile only sees the thread it runs in, so a profiled run reads in
+      # the event loop instead.
+      with profiler.phase('load_tasks'):
+        return next(programs, None)
+
+    async def load() -> None:
+      if self.program_source is None:
+        programs = iter(self.data)
+      else:
+        programs = self.program_source()
+      index = 0
+      while True:
+        await window.acquire()
+        if self.program_source is None:
+          program = next(programs, None)
+        else:
+          program = await read(programs)
+        if program is None:
+          break
+        await program_queue.put((index, program))
+        index += 1
+      for _ in range(queue_size):
+        await program_queue.put(None)
+
+    async def generate() -> None:
+      while (item := await program_queue.get()) is not None:
+        index, program = item
+        await prediction_queue.put(
+            (index, await self._generate_one_prediction(program, llm))
+        )
+
+    async def generate_all() -> None:
+      await asyncio.gather(*[generate() for _ in range(queue_size)])
+      await prediction_queue.put(None)
+
+    async def score() -> dict[str, Any]:
+      log = _PredictionLog(self, log_directory)
+      held_back = {}
+      next_index = 0
+      with log:
+        while (item := await prediction_queue.get()) is not None:
+          index, prediction = item
+          held_back[index] = prediction
+          while next_index in held_back:
+            log.add(*held_back.pop(next_index))
+            next_index += 1
+            window.release()
+          progress.advance(progress_task)
+      return log.results()
+
+    stages = [
+        asyncio.create_task(load()),
+        asyncio.create_task(generate_all()),
+        asyncio.create_task(score()),
+    ]
+    try:
+      await asyncio.gather(*stages)
+    finally:
+      # If a stage fails, the others would wait on their queues forever.
+      for stage in stages:
+        stage.cancel()
+    return stages[-1].result()
+
+  async def predict(
+      self, llm: LlmInterface, programs: Sequence['Program']
+  ) -> list[tuple['Program', str, Any]]:
+    """Queries the LLM for a prediction for each of the given programs.
+
+    Args:
+      llm: The LLM to be queried.
+      programs: The programs, usually `data` or a subset of it.
+
+    Returns:
+      For each program, the program, the raw completion, and the parsed
+      prediction, which is `None` if the completion could not be parsed.
+    """
     futures = []
-    for program in self.data:
+    for program in programs:
       futures.append(self._generate_one_prediction(program, llm))
-    predictions = await asyncio.gather(*futures)
-    per_program_prf1 = [
-        self.metric_fn(result, program.gold_answer)
-        for program, result in predictions
-    ]
-    average_prf1 = metrics.macroaverage(per_program_prf1)
-    return average_prf1
+    return await asyncio.gather(*futures)
+
+  def summarize(
+      self,
+      predictions: Sequence[tuple['Program', str, Any]],
+      log_directory: epath.Path,
+  ) -> dict[str, Any]:
+    """Scores the predictions and writes them to the log directory.
+
+    This writes the same files as `run`, in the order of `predictions`.
+
+    Args:
+      predictions: The output of `predict`.
+      log_directory: A directory, fully owned by the evaluation, to write any
+        outputs.
+
+    Returns:
+      A dictionary with the results of the evaluation.
+    """
+    log = _PredictionLog(self, log_directory)
+    with log:
+      for prediction in predictions:
+        log.add(*prediction)
+    return log.results()
+
+  def build_prompt(
+      self, program: 'SingleFileProgram | MultiFileProgram'
+  ) -> str:
+    """Returns the prompt for a program, with any few-shot examples.
+
+    Each example is followed by its gold answer and the first stop token, so
+    the model learns to end its answer in the same way.
+
+    Args:
+      program: The program to build the prompt for.
+
+    Returns:
+      The prompt.
+    """
+    examples = self.few_shot_examples.get(program.name)
+    if not examples:
+      return self.prompt_source(program).text
+    separator = self.stop_tokens[0] if self.stop_tokens else ''
+    parts = []
+    for example in examples:
+      answer = json.dumps(example.gold_answer)
+      source = self.prompt_source(example).text
+      parts.append(f'{source}\n{answer}\n{separator}\n\n')
+    parts.append(self.prompt_source(program).text)
+    return ''.join(parts)
+
+  def prompt_source(
+      self, program: 'SingleFileProgram | MultiFileProgram'
+  ) -> 'PromptSource':
+    """Returns the source of a program as it is sent to the model.
+
+    The sources are preprocessed with `preprocess_steps`. The result is kept by
+    the task, keyed by the hash of the contents of the program, so each
+    distinct program is only preprocessed once, however large the task.
+
+    Args:
+      program: The program.
+
+    Returns:
+      The preprocessed source, with its size before and after preprocessing.
+    """
+    if not self.preprocess_steps:
+      return PromptSource(text=program.source_code)
+    if isinstance(program, MultiFileProgram):
+      content_hash = program.digest
+    else:
+      content_hash = hashlib.sha256(
+          program.source_code.encode('utf-8')
+      ).hexdigest()
+    prompt_source = self._prompt_sources.get(content_hash)
+    if prompt_source is not None:
+      return prompt_source
+
+    num_removed_tokens = 0
+    num_files = 0
+
+    def canonicalize(source: str) -> str:
+      nonlocal num_removed_tokens, num_files
+      # Only the first file of a program holds the instructions of the task.
+      canonical = preprocessing.canonicalize(
+          source,
+          _COMMENT_SYNTAX[program.language],
+          self.preprocess_steps,
+          has_instructions=num_files == 0,
+      )
+      num_files += 1
+      num_removed_tokens += estimate_num_tokens(source) - estimate_num_tokens(
+          canonical
+      )
+      return canonical
+
+    if isinstance(program, MultiFileProgram):
+      # Each file is preprocessed on its own, so that every file loses its
+      # license header.
+      text = program.assemble_prompt(canonicalize)
+    else:
+      text = canonicalize(program.source_code)
+    num_tokens = estimate_num_tokens(text)
+    prompt_source = PromptSource(
+        text=text,
+        num_raw_tokens=num_tokens + num_removed_tokens,
+        num_tokens=num_tokens,
+    )
+    # Streamed programs are preprocessed in the reader thread, so this is
+    # only ever a single, atomic insertion.
+    self._prompt_sources[content_hash] = prompt_source
+    return prompt_source
+
+  def parse_prediction(self, completion: str) -> Any:
+    """Parses a completion of the LLM into a prediction.
+
+    Args:
+      completion: The raw text generated by the LLM.
+
+    Returns:
+      The prediction, or `None` if the completion could not be parsed.
+    """
+    with profiler.phase('parse'):
+      # Be robust in case model predicts single quotes, which is not
+      #  valid json.
+      json_string = completion.replace("'", '"')
+      try:
+        return json.loads(json_string)
+      except json.JSONDecodeError as e:
+        # TODO: Figure out error handling here
+        print(f'Could not parse prediction: {json_string}')
+        print(e)
+        return None
+
+  def score(self, program: 'Program', prediction: Any) -> dict[str, float]:
+    """Computes the metrics of a single prediction against the gold answer.
+
+    Args:
+      program: The program that the prediction is for.
+      prediction: The parsed prediction, or `None` if it could not be parsed.
+
+    Returns:
+      The metrics for this program.
+    """
+    return self.metric_fn(
+        '' if prediction is None else prediction, program.gold_answer
+    )
+
+  def _generation_stats(
+      self,
+      num_requests: int,
+      num_parse_failures: int,
+      num_truncated: int,
+      num_raw_prompt_tokens: int,
+      num_prompt_tokens: int,
+  ) -> dict[str, Any]:
+    """Summarizes the effect of the generation budget on the predictions.
+
+    If the programs are preprocessed, this also reports how much smaller that
+    made the prompts.
+
+    Args:
+      num_requests: The number of programs.
+      num_parse_failures: The number of completions that could not be parsed.
+      num_truncated: The number of those that used up the generation budget.
+      num_raw_prompt_tokens: The total size of the programs before
+        preprocessing.
+      num_prompt_tokens: The total size of the programs after preprocessing.
+
+    Returns:
+      The statistics.
+    """
+    max_length = self.max_length or DEFAULT_MAX_LENGTH
+    stats = {
+        'max_length': max_length,
+        'default_max_length': DEFAULT_MAX_LENGTH,
+        'stop_tokens': self.stop_tokens,
+        'num_requests': num_requests,
+        'saved_max_tokens': (DEFAULT_MAX_LENGTH - max_length) * num_requests,
+        'num_parse_failures': num_parse_failures,
+        'num_truncated_parse_failures': num_truncated,
+    }
+    if self.preprocess_steps:
+      stats['preprocessing'] = {
+          'steps': [step.name.lower() for step in self.preprocess_steps],
+          'num_raw_prompt_tokens': num_raw_prompt_tokens,
+          'num_prompt_tokens': num_prompt_tokens,
+          'saved_prompt_tokens': num_raw_prompt_tokens - num_prompt_tokens,
+          'saved_fraction': (
+              1 - num_prompt_tokens / num_raw_prompt_tokens
+              if num_raw_prompt_tokens
+              else 0.0
+          ),
+      }
+    return stats
 
   async def _generate_one_prediction(
-      self, program: 'SingleFileProgram', llm: LlmInterface
-  ) -> tuple['SingleFileProgram', str]:
+      self,
+      program: 'SingleFileProgram | MultiFileProgram',
+      llm: LlmInterface,
+  ) -> tuple['SingleFileProgram | MultiFileProgram', str, Any]:
     """Generates a single prediction for a program.
 
     Args:
@@ -176,29 +546,19 @@ class PropertyPredictionTask(Task):
       llm: The LLM to be queried.
 
     Returns:
-      The prediction.
+      The program, the raw completion, and the parsed prediction, which is
+      `None` if the completion could not be parsed.
     """
-    # TODO: Only works for single file programs right now.
     # TODO: We would need to think about what some of the other eval metrics
     #  mean with num_samples > 1. pass@k is OK, but what about P/R/F1?
     predicted_string = await llm.generate(
-        program.source_code,
+        self.build_prompt(program),
         num_samples=1,
-        max_length=DEFAULT_MAX_LENGTH,
-        stop_tokens=DEFAULT_STOP_TOKENS,
+        max_length=self.max_length or DEFAULT_MAX_LENGTH,
+        stop_tokens=self.stop_tokens,
     )
-    # Be robust in case model predicts single quotes, which is not
-    #  valid json.
-    json_string = predicted_string[0]
-    json_string = json_string.replace("'", '"')
-    try:
-      predicted_result = json.loads(json_string)
-      return program, predicted_result
-    except json.JSONDecodeError as e:
-      # TODO: Figure out error handling here
-      print(f'Could not parse prediction: {json_string}')
-      print(e)
-      return program, ''
+    completion = predicted_string[0]
+    return program, completion, self.parse_prediction(completion)
 
   @classmethod
   def from_metadata(cls, metadata: dict[str, Any]) -> 'PropertyPredictionTask':
@@ -222,9 +582,105 @@ class PropertyPredictionTask(Task):
       metadata['output_type'] = _parse_type(metadata['output_type'])
     if 'metric' in metadata:
       metadata['metric'] = metrics.EvaluationMetrics[metadata['metric'].upper()]
+    if 'preprocess_steps' in metadata:
+      metadata['preprocess_steps'] = [
+          preprocessing.Step[step.upper()] if isinstance(step, str) else step
+          for step in metadata['preprocess_steps']
+      ]
     return cls(**metadata)  # pytype: disable=missing-parameter
 
 
+class _PredictionLog:
+  """Scores the predictions of a task one at a time and logs them.
+
+  Only running totals are kept in memory. The per-program results are appended
+  to `predictions.jsonl` (or `predictions_filename`) as they are added, and the
+  averages and generation statistics are available once the log is closed.
+  """
+
+  def __init__(
+      self,
+      task: PropertyPredictionTask,
+      log_directory: epath.Path,
+      predictions_filename: str = PREDICTIONS_FILENAME,
+  ):
+    self._task = task
+    self._log_directory = log_directory
+    self._predictions_filename = predictions_filename
+    self._file = None
+    self._average = metrics.MacroAverage()
+    self._num_requests = 0
+    self._num_parse_failures = 0
+    self._num_truncated = 0
+    self._num_raw_prompt_tokens = 0
+    self._num_prompt_tokens = 0
+
+  def __enter__(self) -> '_PredictionLog':
+    self._file = open(self._log_directory / self._predictions_filename, 'w')
+    return self
+
+  def __exit__(self, *exc_info) -> None:
+    self._file.close()
+    with open(self._log_directory / 'generation_stats.json', 'w') as f:
+      json.dump(
+          self._task._generation_stats(  # pylint: disable=protected-access
+              self._num_requests,
+              self._num_parse_failures,
+              self._num_truncated,
+              self._num_raw_prompt_tokens,
+              self._num_prompt_tokens,
+          ),
+          f,
+          indent=2,
+      )
+
+  def add(self, program: 'Program', completion: str, prediction: Any) -> None:
+    """Scores one prediction and appends it to the log."""
+    with profiler.phase('score'):
+      program_metrics = self._task.score(program, prediction)
+      self._average.add(program_metrics)
+    self._num_requests += 1
+    if self._task.preprocess_steps:
+      prompt_source = self._task.prompt_source(program)
+      self._num_raw_prompt_tokens += prompt_source.num_raw_tokens
+      self._num_prompt_tokens += prompt_source.num_tokens
+    if prediction is None:
+      self._num_parse_failures += 1
+      # Token counts are approximate, so this flags failures whose completion
+      # used up roughly the whole budget.
+      max_length = self._task.max_length or DEFAULT_MAX_LENGTH
+      if estimate_num_tokens(completion) >= max_length:
+        self._num_truncated += 1
+    self._file.write(
+        json.dumps({
+            'name': program.name,
+            'completion': completion,
+            'prediction': prediction,
+            'metrics': program_metrics,
+        })
+        + '\n'
+    )
+
+  def results(self) -> dict[str, float]:
+    """Returns the averages of the metrics of all added predictions."""
+    return self._average.result()
+
+
+def estimate_num_tokens(text: str) -> int:
+  """Returns an approximate number of LLM tokens in the given text.
+
+  This does not depend on any particular tokenizer, so it is only meant for
+  relative comparisons, e.g., for cost estimates and length budgets.
+
+  Args:
+    text: The text to count tokens in.
+
+  Returns:
+    The approximate number of tokens.
+  """
+  return len(_TOKEN_PATTERN.findall(text))
+
+
 # Matches a small subset of Python type annotations.
 _TYPE_DESCRIPTION_PATTERN = re.compile(r'^([a-zA-Z]+)(?:\[(.*)\])?$')
 
@@ -272,8 +728,15 @@ def _parse_single_type(input_str: str) -> type[Any]:
 
 @dataclasses.dataclass(frozen=True, kw_only=True)
 class Program:
-  """Represents a single datum in the benchmark, which is part of a task."""
+  """Represents a single datum in the benchmark, which is part of a task.
 
+  Attributes:
+    name: Identifies the program within its task, e.g., its file name.
+    gold_answer: The correct answer.
+    output_type: The Python type of the answer.
+  """
+
+  name: str
   gold_answer: Any
   output_type: type[Any]
 
@@ -285,8 +748,106 @@ class SingleFileProgram(Program):
   language: Language
 
 
+@dataclasses.dataclass(frozen=True)
+class ManifestEntry:
+  """A source file of a `MultiFileProgram`, as recorded in the task manifest.
+
+  Attributes:
+    path: Path of the file, relative to the program directory.
+    size: Size of the file in bytes.
+    mtime: Modification time of the file, used to detect stale entries.
+    sha256: Hex digest of the contents of the file.
+  """
+
+  path: str
+  size: int
+  mtime: float
+  sha256: str
+
+
+# Comment syntax of each language, for preprocessing and for the file headers
+# of multi-file prompts.
+_COMMENT_SYNTAX = {
+    Language.C: preprocessing.CommentSyntax('//', ('/*', '*/')),
+    Language.C_PLUS_PLUS: preprocessing.CommentSyntax('//', ('/*', '*/')),
+    Language.PYTHON: preprocessing.CommentSyntax('#'),
+    Language.JAVA: preprocessing.CommentSyntax('//', ('/*', '*/')),
+}
+
+# Assembled multi-file prompts, keyed by program digest, least recently used
+# first.
+_PROMPT_CACHE: collections.OrderedDict[str, str] = collections.OrderedDict()
+_PROMPT_CACHE_SIZE = 1024
+
+
+@dataclasses.dataclass(frozen=True)
+class PromptSource:
+  """The source of a program as it is sent to the model.
+
+  Attributes:
+    text: The preprocessed source.
+    num_raw_tokens: The approximate number of tokens before preprocessing, if
+      the source was preprocessed.
+    num_tokens: The approximate number of tokens after preprocessing, if the
+      source was preprocessed.
+  """
+
+  text: str
+  num_raw_tokens: int | None = None
+  num_tokens: int | None = None
+
+
 @dataclasses.dataclass(frozen=True, kw_only=True)
 class MultiFileProgram(Program):
-  """A single program in a task, which is contained in multiple files in a single directory."""
+  """A single program in a task, which is contained in multiple files in a single directory.
+
+  The sources are not kept in memory. The prompt is assembled from the files
+  listed in the manifest the first time `source_code` is accessed, and cached
+  by the digest of the file contents.
+
+  Attributes:
+    path: The program directory.
+    build_command: Command that builds the program, if any.
+    language: The programming language of the program.
+    files: The source files of the program, in prompt order.
+    digest: Hash of the paths and contents of all of the files.
+  """
   path: epath.Path
   build_command: str
+  language: Language
+  files: tuple[ManifestEntry, ...]
+  digest: str
+
+  @property
+  def source_code(self) -> str:
+    prompt = _PROMPT_CACHE.get(self.digest)
+    if prompt is None:
+      prompt = self.assemble_prompt()
+      _PROMPT_CACHE[self.digest] = prompt
+      if len(_PROMPT_CACHE) > _PROMPT_CACHE_SIZE:
+        _PROMPT_CACHE.popitem(last=False)
+    else:
+      _PROMPT_CACHE.move_to_end(self.digest)
+    return prompt
+
+  def assemble_prompt(
+      self, transform: Callable[[str], str] | None = None
+  ) -> str:
+    """Reads the files of the program and joins them into a prompt.
+
+    Unlike `source_code`, this is not cached.
+
+    Args:
+      transform: Applied to the contents of each file, e.g., to preprocess it.
+
+    Returns:
+      The contents of the files, each preceded by a comment with its path.
+    """
+    comment = _COMMENT_SYNTAX[self.language].line
+    parts = []
+    for entry in self.files:
+      source = (self.path / entry.path).read_text(encoding='utf-8')
+      if transform is not None:
+        source = transform(source)
+      parts.append(f'{comment} File: {entry.path}\n{source}')
+    return '\n'.join(parts)
@@ -16,8 +16,10 @@
 
 """Tests for task_lib."""
 
+import json
 import math
 import pytest
+import shutil
 import asyncio
 from typing import List, Set
 
@@ -25,6 +27,7 @@ from etils import epath
 import rich
 import rich.progress
 
+from codesembench.api import preprocessing
 from codesembench.api import task_lib
 from codesembench.api import task_loader
 from codesembench.api import test_utils
@@ -46,6 +49,49 @@ def test_alias_prf1(tmpdir):
   assert math.isclose(results_dict["f1"], 0.638886, abs_tol=1e-3)
 
 
+def test_max_length_fit_from_gold_answers(tmpdir):
+  tasks = task_loader.load_tasks(test_utils.get_tasks_path())
+  task = test_utils._get_task_by_name(tasks, "simple_c_alias")
+  longest_answer = max(
+      task_lib.estimate_num_tokens(json.dumps(p.gold_answer))
+      for p in task.data
+  )
+  assert task.max_length == math.ceil(
+      longest_answer * task_lib.DEFAULT_MAX_LENGTH_MARGIN
+  )
+  assert task.max_length < task_lib.DEFAULT_MAX_LENGTH
+
+  logdir = epath.Path(tmpdir)
+  asyncio.run(
+      task.run(test_utils.MockLlm(), logdir, rich.progress.Progress())
+  )
+  stats = json.loads((logdir / "generation_stats.json").read_text())
+  assert stats["max_length"] == task.max_length
+  assert stats["num_requests"] == 3
+  assert stats["saved_max_tokens"] == 3 * (
+      task_lib.DEFAULT_MAX_LENGTH - task.max_length
+  )
+  assert stats["num_parse_failures"] == 0
+  assert stats["num_truncated_parse_failures"] == 0
+
+
+def test_max_length_from_metadata():
+  task = task_lib.PropertyPredictionTask.from_metadata({
+      "name": "t",
+      "description": "",
+      "language": "C",
+      "task_type": "per_file",
+      "file_pattern": "*.c",
+      "tags": [],
+      "output_type": "List[str]",
+      "authors": "",
+      "max_length": 7,
+      "stop_tokens": ["]]"],
+  })
+  assert task.max_length == 7
+  assert task.stop_tokens == ["]]"]
+
+
 @pytest.mark.parametrize(
     "type_str, expected_type",
     [
@@ -57,3 +103,197 @@ def test_alias_prf1(tmpdir):
 )
 def test_parse_type(type_str, expected_type):
   assert task_lib._parse_type(type_str) == expected_type
+
+
+class _SlowLlm(task_lib.LlmInterface):
+  """Records the number of requests in flight."""
+
+  def __init__(self):
+    self.in_flight = 0
+    self.max_in_flight = 0
+    self.num_read_at_first_request = None
+    self.num_read = 0
+    self.num_requests = 0
+
+  async def generate(self, prompt, num_samples, max_length, stop_tokens):
+    if self.num_read_at_first_request is None:
+      self.num_read_at_first_request = self.num_read
+    self.in_flight += 1
+    self.max_in_flight = max(self.max_in_flight, self.in_flight)
+    self.num_requests += 1
+    # Every other request is slow, so completions arrive out of order.
+    await asyncio.sleep(0.002 if self.num_requests % 2 else 0.0)
+    self.in_flight -= 1
+    return ["[]"]
+
+
+def test_run_streams_programs_with_bounded_queues(tmpdir):
+  task = task_loader.load_task_metadata(
+      test_utils.get_tasks_path() / "simple_c_alias"
+  )
+  task.max_length = 16
+  llm = _SlowLlm()
+  num_programs = 50
+
+  def program_source():
+    for i in range(num_programs):
+      llm.num_read += 1
+      yield task_lib.SingleFileProgram(
+          name=f"p{i}.c",
+          source_code="int x;",
+          language=task.language,
+          gold_answer=[],
+          output_type=task.output_type,
+      )
+
+  task.program_source = program_source
+  logdir = epath.Path(tmpdir)
+  asyncio.run(
+      task.run(llm, logdir, rich.progress.Progress(), queue_size=2)
+  )
+  assert llm.max_in_flight <= 2
+  # Programs are queried before the whole task has been read.
+  assert llm.num_read_at_first_request < num_programs
+  lines = (logdir / task_lib.PREDICTIONS_FILENAME).read_text().splitlines()
+  # The predictions are logged in the order of the programs.
+  assert [json.loads(line)["name"] for line in lines] == [
+      f"p{i}.c" for i in range(num_programs)
+  ]
+
+
+class _SlowFirstLlm(task_lib.LlmInterface):
+  """Answers the first request last, and records the reads meanwhile."""
+
+  def __init__(self):
+    self.num_read = 0
+    self.num_read_during_first_request = None
+    self.num_requests = 0
+
+  async def generate(self, prompt, num_samples, max_length, stop_tokens):
+    self.num_requests += 1
+    if self.num_requests == 1:
+      await asyncio.sleep(0.05)
+      self.num_read_during_first_request = self.num_read
+    return ["[]"]
+
+
+def test_run_bounds_predictions_held_back_by_a_slow_request(tmpdir):
+  task = task_loader.load_task_metadata(
+      test_utils.get_tasks_path() / "simple_c_alias"
+  )
+  task.max_length = 16
+  llm = _SlowFirstLlm()
+
+  def program_source():
+    for i in range(50):
+      llm.num_read += 1
+      yield task_lib.SingleFileProgram(
+          name=f"p{i}.c",
+          source_code="int x;",
+          language=task.language,
+          gold_answer=[],
+          output_type=task.output_type,
+      )
+
+  task.program_source = program_source
+  asyncio.run(
+      task.run(
+          llm, epath.Path(tmpdir), rich.progress.Progress(), queue_size=2
+      )
+  )
+  # Later programs wait for the first one to be logged.
+  assert llm.num_read_during_first_request <= 2
+  assert llm.num_requests == 50
+
+
+_LICENSE_HEADER = (
+    "/*\n"
+    " * Copyright 2024 Example Authors.\n"
+    " * Licensed under the Apache License, Version 2.0.\n"
+    " */\n"
+    "\n"
+)
+
+
+def _enable_preprocessing(task_dir):
+  metadata = json.loads((task_dir / "metadata.json").read_text())
+  metadata["preprocess_steps"] = [
+      "license_header", "trailing_whitespace", "blank_lines"
+  ]
+  (task_dir / "metadata.json").write_text(json.dumps(metadata))
+
+
+def test_prompt_sources_are_kept_for_large_tasks(monkeypatch):
+  task = task_loader.load_task_metadata(
+      test_utils.get_tasks_path() / "simple_c_alias"
+  )
+  task.preprocess_steps = [preprocessing.Step.BLANK_LINES]
+  programs = [
+      task_lib.SingleFileProgram(
+          name=f"p{i}.c",
+          source_code=f"int x{i};\n\n",
+          language=task.language,
+          gold_answer=[],
+          output_type=task.output_type,
+      )
+      for i in range(5000)
+  ]
+  for program in programs:
+    task.prompt_source(program)
+  monkeypatch.setattr(
+      preprocessing,
+      "canonicalize",
+      lambda *_, **__: pytest.fail("canonicalized twice"),
+  )
+  assert task.prompt_source(programs[0]).text == "int x0;\n"
+
+
+def test_preprocessed_prompts(tmp_path):
+  tasks_dir = epath.Path(tmp_path / "tasks")
+  shutil.copytree(test_utils.get_tasks_path(), tasks_dir)
+  task_dir = tasks_dir / "simple_c_alias"
+  source_path = task_dir / "alias1.c"
+  source_path.write_text(_LICENSE_HEADER + source_path.read_text())
+  _enable_preprocessing(task_dir)
+
+  task = task_loader.load_one_task(task_dir)
+  program = next(p for p in task.data if p.name == "alias1.c")
+  prompt = task.build_prompt(program)
+  assert "Copyright" not in prompt
+  assert prompt.startswith("// In the following C program")
+  assert "\n\n" not in prompt
+  # The preprocessed source is cached by content.
+  assert task.prompt_source(program) is task.prompt_source(program)
+
+  logdir = epath.Path(tmp_path / "logs")
+  logdir.mkdir()
+  results = asyncio.run(
+      task.run(test_utils.MockLlm(), logdir, rich.progress.Progress())
+  )
+  assert math.isclose(results["f1"], 0.638886, abs_tol=1e-3)
+  stats = json.loads((logdir / "generation_stats.json").read_text())
+  preprocessing_stats = stats["preprocessing"]
+  assert preprocessing_stats["saved_prompt_tokens"] > 0
+  assert preprocessing_stats["num_prompt_tokens"] == sum(
+      task_lib.estimate_num_tokens(task.build_prompt(p)) for p in task.data
+  )
+
+
+def test_preprocessed_multifile_prompts(tmp_path):
+  tasks_dir = epath.Path(tmp_path / "tasks")
+  shutil.copytree(test_utils.get_multifile_tasks_path(), tasks_dir)
+  task_dir = tasks_dir / "simple_c_multifile"
+  for name in ("main.c", "swap.c"):
+    source_path = task_dir / "swap" / name
+    source_path.write_text(_LICENSE_HEADER + source_path.read_text())
+  _enable_preprocessing(task_dir)
+
+  task = task_loader.load_one_task(task_dir)
+  swap = next(p for p in task.data if p.name == "swap")
+  assert swap.source_code.count("Copyright") == 2
+  prompt_source = task.prompt_source(swap)
+  assert "Copyright" not in prompt_source.text
+  assert "// File: swap.c\n" in prompt_source.text
+  assert prompt_source.num_raw_tokens - prompt_source.num_tokens == 2 * (
+      task_lib.estimate_num_tokens(_LICENSE_HEADER)
+  )
@@ -20,33 +20,118 @@ Any directory that is a subdirectory of a given path and contains
 a file called `metadata.json` will be interpreted as containing a task.
 """
 
+import fnmatch
+import functools
+import hashlib
 import json
-from typing import Any
+from typing import Any, Iterator
 
 from etils import epath
 
+from codesembench.api import few_shot
 from codesembench.api import task_lib
 
 METADATA_FILENAME = 'metadata.json'
+# Index of the source files of a per-directory task, written next to the
+# metadata so that later loads only need to stat the files.
+MANIFEST_FILENAME = '.manifest.json'
+_MANIFEST_VERSION = 1
 
 
-def load_tasks(base_path: epath.Path) -> list[task_lib.Task]:
-  """Loads all tasks in the given base path."""
+def load_tasks(
+    base_path: epath.Path, stream_programs: bool = False
+) -> list[task_lib.Task]:
+  """Loads all tasks in the given base path.
+
+  Args:
+    base_path: The directory containing the task directories.
+    stream_programs: Whether to defer reading the programs, see
+      `load_one_task`.
+
+  Returns:
+    The tasks, sorted by directory name.
+  """
   tasks = []
   for metadata_path in sorted(base_path.glob(f'*/{METADATA_FILENAME}')):
-    tasks.append(load_one_task(metadata_path.parent))
+    tasks.append(load_one_task(metadata_path.parent, stream_programs))
   return tasks
 
 
-def load_one_task(path: epath.Path) -> task_lib.Task:
+def load_task_metadata(path: epath.Path) -> task_lib.PropertyPredictionTask:
+  """Loads the task in the given directory, without its programs."""
   with open(path / METADATA_FILENAME, 'r') as f:
     task_metadata = json.load(f)
-    task_obj = task_lib.PropertyPredictionTask.from_metadata(task_metadata)
-    if task_obj.task_type == task_lib.TaskType.PER_FILE:
-      task_obj.data = load_single_file_programs(task_obj, path)
-    else:
-      raise ValueError(f'Unknown task type: {task_obj.task_type}')
+  task_obj = task_lib.PropertyPredictionTask.from_metadata(task_metadata)
+  if task_obj.task_type not in (
+      task_lib.TaskType.PER_FILE,
+      task_lib.TaskType.PER_DIRECTORY,
+  ):
+    raise ValueError(f'Unknown task type: {task_obj.task_type}')
+  return task_obj
+
+
+def load_one_task(
+    path: epath.Path, stream_programs: bool = False
+) -> task_lib.Task:
+  """Loads the task in the given directory.
+
+  Args:
+    path: The task directory.
+    stream_programs: If set, the programs are not read here. Instead, the
+      task reads them one at a time from `iter_programs` while it runs, so the
+      first requests are sent before the whole task has been read. Only the
+      gold answers are read up front, if they are needed to fit the generation
+      budget. Tasks with few-shot examples need all of their programs to
+      select the examples, so they are always loaded in full.
+
+  Returns:
+    The task.
+  """
+  task_obj = load_task_metadata(path)
+  if stream_programs and task_obj.num_shots == 0:
+    if task_obj.max_length is None:
+      task_obj.fit_max_length(iter_gold_answers(task_obj, path))
+    task_obj.program_source = functools.partial(iter_programs, task_obj, path)
     return task_obj
+  task_obj.data = list(iter_programs(task_obj, path))
+  if task_obj.max_length is None:
+    task_obj.fit_max_length()
+  if task_obj.num_shots > 0:
+    neighbors = few_shot.load_or_build_neighbors(
+        task_obj.data, task_obj.num_shots, path
+    )
+    task_obj.few_shot_examples = {
+        program.name: [task_obj.data[j] for j in row if j >= 0]
+        for program, row in zip(task_obj.data, neighbors)
+    }
+  return task_obj
+
+
+def iter_programs(
+    task: task_lib.PropertyPredictionTask, path: epath.Path
+) -> Iterator[task_lib.Program]:
+  """Reads the programs of a task one at a time."""
+  if task.task_type == task_lib.TaskType.PER_FILE:
+    return iter_single_file_programs(task, path)
+  return iter_multi_file_programs(task, path)
+
+
+def iter_gold_answers(
+    task: task_lib.PropertyPredictionTask, path: epath.Path
+) -> Iterator[Any]:
+  """Reads the gold answers of a task, without reading its programs."""
+  if task.task_type == task_lib.TaskType.PER_FILE:
+    answer_paths = (
+        path / task.answer_path / source_path.name
+        for source_path in sorted(path.glob(task.file_pattern))
+    )
+  else:
+    answer_paths = (
+        path / task.answer_path / f'{program_dir.name}.json'
+        for program_dir in _program_dirs(task, path)
+    )
+  for answer_path in answer_paths:
+    yield read_answer_text(answer_path)
 
 
 def read_answer_text(path: epath.Path) -> Any:
@@ -59,21 +144,198 @@ def load_single_file_programs(
     task: task_lib.PropertyPredictionTask, path: epath.Path
 ):
   """Loads the programs and answers for a per-file task."""
-  result = []
-  for source_path in path.glob(task.file_pattern):
+  return list(iter_single_file_programs(task, path))
+
+
+def iter_single_file_programs(
+    task: task_lib.PropertyPredictionTask, path: epath.Path
+) -> Iterator[task_lib.SingleFileProgram]:
+  """Reads the programs and answers for a per-file task one at a time."""
+  for source_path in sorted(path.glob(task.file_pattern)):
     try:
-      program = source_path.read_text(encoding='utf-8')
+      source_code = source_path.read_text(encoding='utf-8')
       answer_path = path / task.answer_path / source_path.name
       answer = read_answer_text(answer_path)
-      result.append(
-          task_lib.SingleFileProgram(
-              source_code=program,
-              language=task.language,
-              gold_answer=answer,
-              output_type=task.output_type,
-          )
-      )
     except Exception as e:
       e.add_note(f'Could not read file: {source_path}')
       raise e
-  return result
+    program = task_lib.SingleFileProgram(
+        name=source_path.name,
+        source_code=source_code,
+        language=task.language,
+        gold_answer=answer,
+        output_type=task.output_type,
+    )
+    if task.preprocess_steps:
+      # Preprocess while loading, so the prompts are ready when they are sent.
+      # The sources of multi-file programs are only read when they are first
+      # needed, and are preprocessed then.
+      task.prompt_source(program)
+    yield program
+
+
+def _hash_file(path: epath.Path) -> str:
+  return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def _read_manifest(path: epath.Path) -> dict[str, list[task_lib.ManifestEntry]]:
+  """Reads the manifest of a task, or returns an empty one if unusable."""
+  manifest_path = path / MANIFEST_FILENAME
+  try:
+    manifest = json.loads(manifest_path.read_text(encoding='utf-8'))
+  except (OSError, ValueError):
+    return {}
+  if manifest.get('version') != _MANIFEST_VERSION:
+    return {}
+  return {
+      program_name: [task_lib.ManifestEntry(*entry) for entry in entries]
+      for program_name, entries in manifest['programs'].items()
+  }
+
+
+def _write_manifest(
+    path: epath.Path, manifest: dict[str, list[task_lib.ManifestEntry]]
+) -> None:
+  programs = {
+      program_name: [
+          [entry.path, entry.size, entry.mtime, entry.sha256]
+          for entry in entries
+      ]
+      for program_name, entries in manifest.items()
+  }
+  try:
+    (path / MANIFEST_FILENAME).write_text(
+        json.dumps({'version': _MANIFEST_VERSION, 'programs': programs}),
+        encoding='utf-8',
+    )
+  except OSError:
+    # The tasks may live on a read-only filesystem, in which case the
+    # files are hashed again on the next load.
+    pass
+
+
+def build_program_manifest(
+    program_dir: epath.Path,
+    file_pattern: str,
+    cached_entries: list[task_lib.ManifestEntry],
+) -> list[task_lib.ManifestEntry]:
+  """Lists the source files of a program directory with their hashes.
+
+  Files whose size and modification time match their cached entry are not
+  read again.
+
+  Args:
+    program_dir: The program directory.
+    file_pattern: Glob that the path of a file, relative to the program
+      directory, must match to be part of the program.
+    cached_entries: Entries from a previous manifest of this program.
+
+  Returns:
+    The manifest entries, sorted by path.
+  """
+  cached = {entry.path: entry for entry in cached_entries}
+  entries = []
+  for directory, _, filenames in program_dir.walk():
+    for filename in filenames:
+      file_path = directory / filename
+      relative_path = str(file_path.relative_to(program_dir))
+      if not fnmatch.fnmatch(relative_path, file_pattern):
+        continue
+      stat = file_path.stat()
+      entry = cached.get(relative_path)
+      if entry is None or (entry.size, entry.mtime) != (
+          stat.length,
+          stat.mtime,
+      ):
+        entry = task_lib.ManifestEntry(
+            path=relative_path,
+            size=stat.length,
+            mtime=stat.mtime,
+            sha256=_hash_file(file_path),
+        )
+      entries.append(entry)
+  return sorted(entries, key=lambda entry: entry.path)
+
+
+def _program_digest(entries: list[task_lib.ManifestEntry]) -> str:
+  digest = hashlib.sha256()
+  for entry in entries:
+    digest.update(f'{entry.path}\0{entry.sha256}\0'.encode('utf-8'))
+  return digest.hexdigest()
+
+
+def _program_dirs(
+    task: task_lib.PropertyPredictionTask, path: epath.Path
+) -> Iterator[epath.Path]:
+  """Yields the program directories of a per-directory task, sorted by name."""
+  for program_dir in sorted(path.iterdir()):
+    if (
+        program_dir.is_dir()
+        and program_dir.name != task.answer_path
+        and not program_dir.name.startswith('.')
+    ):
+      yield program_dir
+
+
+def load_multi_file_programs(
+    task: task_lib.PropertyPredictionTask, path: epath.Path
+):
+  """Loads the programs and answers for a per-directory task.
+
+  Every subdirectory of the task, other than the answer directory, is a
+  program. The gold answer for program `foo` is read from
+  `<answer_path>/foo.json`. Only the manifest of the source files is built
+  here; the sources are read when the prompt is first needed.
+
+  Args:
+    task: The task to load the programs for.
+    path: The task directory.
+
+  Returns:
+    The programs, sorted by directory name.
+  """
+  return list(iter_multi_file_programs(task, path))
+
+
+def iter_multi_file_programs(
+    task: task_lib.PropertyPredictionTask, path: epath.Path
+) -> Iterator[task_lib.MultiFileProgram]:
+  """Reads the programs of a per-directory task one at a time.
+
+  See `load_multi_file_programs`. The manifest is updated once all programs
+  have been read.
+
+  Args:
+    task: The task to load the programs for.
+    path: The task directory.
+
+  Yields:
+    The programs, sorted by directory name.
+  """
+  cached_manifest = _read_manifest(path)
+  manifest = {}
+  for program_dir in _program_dirs(task, path):
+    try:
+      entries = build_program_manifest(
+          program_dir,
+          task.file_pattern,
+          cached_manifest.get(program_dir.name, []),
+      )
+      answer_path = path / task.answer_path / f'{program_dir.name}.json'
+      answer = read_answer_text(answer_path)
+    except Exception as e:
+      e.add_note(f'Could not read program directory: {program_dir}')
+      raise e
+    manifest[program_dir.name] = entries
+    yield task_lib.MultiFileProgram(
+        name=program_dir.name,
+        path=program_dir,
+        build_command=task.build_command,
+        language=task.language,
+        files=tuple(entries),
+        digest=_program_digest(entries),
+        gold_answer=answer,
+        output_type=task.output_type,
+    )
+  if manifest != cached_manifest:
+    _write_manifest(path, manifest)
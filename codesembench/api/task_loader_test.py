@@ -17,7 +17,9 @@
 """Tests for task_loader.py."""
 
 import pytest
+import shutil
 import typing
+from etils import epath
 from codesembench.api import task_lib
 from codesembench.api import task_loader
 from codesembench.api import test_utils
@@ -38,3 +40,83 @@ def test_loading_simple_tasks():
   alias_task = typing.cast(task_lib.PropertyPredictionTask, alias_task)
   for program in alias_task.data:
     assert isinstance(program.gold_answer, list)
+
+
+def test_programs_are_read_in_name_order(monkeypatch):
+  tasks_path = test_utils.get_tasks_path()
+  path_type = type(tasks_path)
+  glob = path_type.glob
+  # Filesystems list directories in no particular order.
+  monkeypatch.setattr(
+      path_type,
+      "glob",
+      lambda self, pattern: reversed(sorted(glob(self, pattern))),
+  )
+  task = task_loader.load_one_task(tasks_path / "simple_c_alias")
+  names = [program.name for program in task.data]
+  assert names == sorted(names)
+
+
+def _copy_multifile_tasks(tmp_path):
+  # Loading writes the manifest into the task directory.
+  tasks_path = tmp_path / "tasks"
+  shutil.copytree(test_utils.get_multifile_tasks_path(), tasks_path)
+  return epath.Path(tasks_path)
+
+
+def test_loading_per_directory_tasks(tmp_path):
+  tasks = task_loader.load_tasks(_copy_multifile_tasks(tmp_path))
+  assert [task.name for task in tasks] == ["simple_c_multifile"]
+  task = typing.cast(task_lib.PropertyPredictionTask, tasks[0])
+  assert task.task_type == task_lib.TaskType.PER_DIRECTORY
+  assert [program.path.name for program in task.data] == ["counter", "swap"]
+
+  swap = task.data[1]
+  assert isinstance(swap, task_lib.MultiFileProgram)
+  assert swap.gold_answer == ["swap"]
+  assert [entry.path for entry in swap.files] == [
+      "main.c", "swap.c", "swap.h"
+  ]
+  assert swap.source_code.startswith("// File: main.c\n")
+  assert "// File: swap.h\nvoid swap(int *x, int *y);" in swap.source_code
+
+
+def test_manifest_avoids_rehashing(tmp_path, monkeypatch):
+  tasks_path = _copy_multifile_tasks(tmp_path)
+  task_path = tasks_path / "simple_c_multifile"
+  first = task_loader.load_one_task(task_path)
+  assert (task_path / task_loader.MANIFEST_FILENAME).exists()
+
+  hashed = []
+  original_hash_file = task_loader._hash_file
+  def recording_hash_file(path):
+    hashed.append(path.name)
+    return original_hash_file(path)
+  monkeypatch.setattr(task_loader, "_hash_file", recording_hash_file)
+
+  second = task_loader.load_one_task(task_path)
+  assert not hashed
+  assert [p.digest for p in first.data] == [p.digest for p in second.data]
+
+  (task_path / "swap" / "swap.h").write_text(
+      "void swap(int *left, int *right);\n"
+  )
+  third = task_loader.load_one_task(task_path)
+  assert hashed == ["swap.h"]
+  assert third.data[0].digest == first.data[0].digest
+  assert third.data[1].digest != first.data[1].digest
+  assert "int *left, int *right" in third.data[1].source_code
+
+
+@pytest.mark.parametrize("multifile", [False, True])
+def test_streamed_tasks_read_programs_lazily(tmp_path, multifile):
+  if multifile:
+    tasks_path = _copy_multifile_tasks(tmp_path)
+  else:
+    tasks_path = test_utils.get_tasks_path()
+  loaded = task_loader.load_tasks(tasks_path)
+  streamed = task_loader.load_tasks(tasks_path, stream_programs=True)
+  for loaded_task, streamed_task in zip(loaded, streamed, strict=True):
+    assert not streamed_task.data
+    assert streamed_task.max_length == loaded_task.max_length
+    assert list(streamed_task.program_source()) == loaded_task.data
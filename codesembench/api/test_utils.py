@@ -16,7 +16,11 @@
 
 """Utilities used in the unit tests."""
 
-from typing import Sequence
+import gzip
+import http.server
+import json
+import threading
+from typing import Any, Sequence
 
 from etils import epath
 
@@ -30,6 +34,13 @@ def get_tasks_path():
   )
 
 
+def get_multifile_tasks_path():
+  return (
+      epath.Path(__file__).parent
+      / "testdata/multifile_tasks"
+  )
+
+
 def _get_task_by_name(
     tasks: Sequence[task_lib.Task], name: str
 ) -> task_lib.Task:
@@ -75,3 +86,79 @@ class MockLlm(task_lib.LlmInterface):
       if k in prompt:
         result = self._examples[k]
     return [result]
+
+
+def _mock_answer(prompt: str) -> str:
+  result = ''
+  for k in MOCK_LLM_EXAMPLES.keys():
+    if k in prompt:
+      result = MOCK_LLM_EXAMPLES[k]
+  return result
+
+
+class _StandInHandler(http.server.BaseHTTPRequestHandler):
+  """Answers OpenAI-style completion requests with the canned answers."""
+
+  # Needed for keep-alive connections.
+  protocol_version = "HTTP/1.1"
+
+  def do_POST(self):  # pylint: disable=invalid-name
+    body = self.rfile.read(int(self.headers["Content-Length"]))
+    if self.headers.get("Content-Encoding") == "gzip":
+      body = gzip.decompress(body)
+    request = json.loads(body)
+    self.server.record(self.client_address, dict(self.headers), request)
+    completion = _mock_answer(request["prompt"])
+    response = json.dumps(
+        {"choices": [{"text": completion}] * request.get("n", 1)}
+    ).encode("utf-8")
+    self.send_response(200)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(response)))
+    self.end_headers()
+    self.wfile.write(response)
+
+  def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+    del format, args
+
+
+class StandInLlmServer(http.server.ThreadingHTTPServer):
+  """Local HTTP server that stands in for a completions API in tests.
+
+  Use as a context manager; the server runs in a background thread.
+
+  Attributes:
+    requests: The decoded JSON bodies of all requests received.
+    headers: The headers of all requests received.
+    client_addresses: The set of client (host, port) pairs seen, i.e., one
+      entry per TCP connection that was opened.
+  """
+
+  daemon_threads = True
+
+  def __init__(self):
+    super().__init__(("127.0.0.1", 0), _StandInHandler)
+    self.requests: list[Any] = []
+    self.headers: list[dict[str, str]] = []
+    self.client_addresses: set[tuple[str, int]] = set()
+    self._lock = threading.Lock()
+    self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+  @property
+  def url(self) -> str:
+    host, port = self.server_address[:2]
+    return f"http://{host}:{port}/v1/completions"
+
+  def record(self, client_address, headers, request):
+    with self._lock:
+      self.client_addresses.add(client_address)
+      self.headers.append(headers)
+      self.requests.append(request)
+
+  def __enter__(self):
+    self._thread.start()
+    return self
+
+  def __exit__(self, *args):
+    self.shutdown()
+    self.server_close()
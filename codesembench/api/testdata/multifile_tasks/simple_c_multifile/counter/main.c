@@ -0,0 +1,11 @@
+// In the following C program, which functions are called from main?
+// Please output the response as a list of function names, in Python syntax.
+
+#include "util/counter.h"
+
+int main(void) {
+  struct counter c;
+  counter_init(&c);
+  counter_add(&c, 2);
+  return counter_get(&c);
+}
@@ -0,0 +1,7 @@
+#include "counter.h"
+
+void counter_init(struct counter *c) { c->value = 0; }
+
+void counter_add(struct counter *c, int n) { c->value += n; }
+
+int counter_get(const struct counter *c) { return c->value; }
@@ -0,0 +1,5 @@
+struct counter { int value; };
+
+void counter_init(struct counter *c);
+void counter_add(struct counter *c, int n);
+int counter_get(const struct counter *c);
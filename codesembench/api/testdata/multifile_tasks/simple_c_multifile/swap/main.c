@@ -0,0 +1,10 @@
+// In the following C program, which functions are called from main?
+// Please output the response as a list of function names, in Python syntax.
+
+#include "swap.h"
+
+int main(void) {
+  int a = 1, b = 2;
+  swap(&a, &b);
+  return a;
+}
@@ -0,0 +1,7 @@
+#include "swap.h"
+
+void swap(int *x, int *y) {
+  int t = *x;
+  *x = *y;
+  *y = t;
+}
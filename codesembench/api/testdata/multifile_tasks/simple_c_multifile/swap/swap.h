@@ -0,0 +1 @@
+void swap(int *x, int *y);
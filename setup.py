@@ -26,6 +26,8 @@ setup(
     packages=find_packages(),  # Automatically finds packages
     install_requires=[
 	"epath",
+	"httpx",
+	"numpy",
 	"pytest"
     ]
 )